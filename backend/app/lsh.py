@@ -0,0 +1,213 @@
+"""
+Approximate candidate search with MinHash and LSH (locality sensitive hashing).
+
+The exact matcher looks at everyone who shares an interest with you. With
+a million users and a handful of popular interests, that is most people.
+In 'lsh' mode (Config.MATCHER) we only look at people who are likely to
+share a lot of interests with you, and score just them exactly.
+
+How it works:
+- Each user's interest set gets a MinHash signature: for each of
+  bands x rows hash functions, the smallest hash of any of their interests.
+  Two users agree on one of those numbers with probability equal to the
+  Jaccard similarity of their interest sets.
+- The signature is cut into bands of `rows` numbers, and each band is a
+  bucket key. Users with similar interests very likely share at least
+  one bucket; users with little in common rarely do.
+- Candidates are the people in your buckets (at most
+  LSH_MAX_CANDIDATES of them, the ones sharing the most buckets with you),
+  and the scores are computed exactly.
+
+So a score is never wrong, but a good match can be missed. The recall
+for a setting can be measured with benchmark_matcher.py.
+"""
+
+import sys
+import os
+import random
+import heapq
+import threading
+import zlib
+from collections import Counter
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_db import get_all_user_interests, get_user_interests, on_interests_changed, read_view
+from config import Config
+
+# Hash values are taken modulo this prime (2^31 - 1)
+_PRIME = 2147483647
+
+
+class MinHashIndex:
+    """
+    MinHash signatures of every user's interests, grouped into LSH buckets.
+
+    Built from the whole interests table by a background thread, started
+    by the first lookup - until it is done, candidates() returns None and
+    the exact matcher is used. After that, interest changes are noted as
+    they are reported and applied at the next lookup, the same way as the
+    recommendations cache. When the whole table was reloaded, a new index
+    is built in the background again while lookups keep using this one.
+    """
+
+    def __init__(self, bands, rows, max_candidates, seed=0):
+        self.bands = bands
+        self.rows = rows
+        self.max_candidates = max_candidates
+        # One (a, b) pair per hash function: h(x) = (a * x + b) mod prime
+        rng = random.Random(seed)
+        self._hashes = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+                        for _ in range(bands * rows)]
+        self._name_hashes = {}
+        # (band number, band values) -> set of user IDs
+        self._buckets = {}
+        # user_id -> that user's bucket keys
+        self._keys = {}
+        self._built = False
+        self._lock = threading.Lock()
+        # Changes not applied yet - None in the set means "everything"
+        self._changed = set()
+        self._changed_lock = threading.Lock()
+        # Background builds: whether one is running, whether another one
+        # is needed after it, and the changes seen while it runs (the new
+        # index may have read the interests before them)
+        self._building = False
+        self._build_wanted = False
+        self._applied_while_building = set()
+        self._built_listeners = []
+
+    def on_built(self, callback):
+        """Call callback() whenever a newly built index takes over"""
+        self._built_listeners.append(callback)
+
+    def signature(self, interests):
+        """Get the MinHash signature of a list of interest names"""
+        return [min(values) for values in zip(*[self._hash_values(name) for name in set(interests)])]
+
+    def _hash_values(self, name):
+        # There are few different interests, so each one is only hashed once
+        values = self._name_hashes.get(name)
+        if values is None:
+            x = zlib.crc32(name.encode('utf-8'))
+            values = self._name_hashes[name] = [(a * x + b) % _PRIME for a, b in self._hashes]
+        return values
+
+    def interests_changed(self, user_id):
+        """Take note that a user's interests changed (None: anyone's may have)"""
+        with self._changed_lock:
+            self._changed.add(user_id)
+
+    def candidates(self, user_id):
+        """
+        Get the IDs of the users who share an LSH bucket with a user, or
+        None if the index isn't built yet
+        """
+        # Same lock order as the recommendations cache: database, then index
+        with read_view(), self._lock:
+            self._apply_changes()
+            if not self._built:
+                return None
+            return self.lookup(user_id)
+
+    def lookup(self, user_id):
+        """candidates() without catching up on changes first"""
+        # How many buckets each person shares with the user
+        hits = Counter()
+        for key in self._keys.get(user_id, ()):
+            hits.update(self._buckets[key])
+        hits.pop(user_id, None)
+        if len(hits) <= self.max_candidates:
+            return set(hits)
+        # Too many - keep the people in the most of our buckets, who are
+        # the most likely to share a lot of interests
+        return set(heapq.nsmallest(self.max_candidates, hits, key=lambda other_id: (-hits[other_id], other_id)))
+
+    def build(self, interests_by_user):
+        """Index everyone from scratch, from a dict of user ID -> interest names"""
+        self._buckets, self._keys = self._index(interests_by_user)
+        self._built = True
+
+    def _index(self, interests_by_user):
+        """Get the buckets and bucket keys of everyone in a dict of user ID -> interest names"""
+        buckets = {}
+        keys = {}
+        for user_id, interests in interests_by_user.items():
+            if interests:
+                keys[user_id] = self._bucket_keys(interests)
+                for key in keys[user_id]:
+                    buckets.setdefault(key, set()).add(user_id)
+        return buckets, keys
+
+    def _bucket_keys(self, interests):
+        signature = self.signature(interests)
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+                for band in range(self.bands)]
+
+    def _add(self, user_id, interests):
+        if not interests:
+            return
+        keys = self._keys[user_id] = self._bucket_keys(interests)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(user_id)
+
+    def _remove(self, user_id):
+        for key in self._keys.pop(user_id, ()):
+            bucket = self._buckets[key]
+            bucket.discard(user_id)
+            if not bucket:
+                del self._buckets[key]
+
+    def _apply_changes(self):
+        with self._changed_lock:
+            changed, self._changed = self._changed, set()
+        if not self._built or None in changed:
+            self._start_build()
+            changed.discard(None)
+        if self._building:
+            self._applied_while_building.update(changed)
+        if not self._built:
+            return
+        for user_id in changed:
+            self._remove(user_id)
+            self._add(user_id, get_user_interests(user_id))
+
+    def _start_build(self):
+        """Build a new index in the background (call with self._lock held)"""
+        self._build_wanted = True
+        if not self._building:
+            self._building = True
+            threading.Thread(target=self._build_in_background, daemon=True).start()
+
+    def _build_in_background(self):
+        while True:
+            with self._lock:
+                if not self._build_wanted:
+                    self._building = False
+                    return
+                self._build_wanted = False
+                self._applied_while_building = set()
+
+            # The slow part runs without any lock; only reading the
+            # interests holds the database's read lock
+            try:
+                buckets, keys = self._index(get_all_user_interests())
+            except BaseException:
+                # The next lookup tries again if there is no index yet
+                with self._lock:
+                    self._building = False
+                raise
+
+            with self._lock:
+                self._buckets, self._keys = buckets, keys
+                self._built = True
+                # Apply the changes seen while building once more, to this index
+                applied, self._applied_while_building = self._applied_while_building, set()
+            with self._changed_lock:
+                self._changed.update(applied)
+            for callback in self._built_listeners:
+                callback()
+
+
+lsh_index = MinHashIndex(Config.LSH_BANDS, Config.LSH_ROWS, Config.LSH_MAX_CANDIDATES)
+# Only the LSH matcher looks changes up - otherwise they would pile up unread
+if Config.MATCHER == 'lsh':
+    on_interests_changed(lsh_index.interests_changed)
@@ -0,0 +1,316 @@
+"""
+Batch match scoring - scores one user against many candidates at once.
+
+Looking up both users' interests for every pair is fine for one pair but
+slow when /find compares you with everyone. Here each user's interests
+come back as a set of interest IDs, fetched in a single call, so every
+candidate costs one set intersection.
+
+Only people who share an interest with you can score above 0, so
+rank_candidates starts from the lists of users who have each of your
+interests instead of from everyone. Its cost grows with the number of
+people you overlap with, not with the number of users.
+
+With Config.MATCHER = 'lsh', candidates come from MinHash/LSH buckets
+instead (see lsh.py) - fewer people to score, but some can be missed.
+Those lists are never taken as everyone who scores: past their end, and
+for the people with a score of 0, everyone is scored exactly.
+
+feed_page serves the same ranking a page at a time, for the feed endpoint.
+
+recommendations keeps the top of each user's ranking in memory, so a
+swipe on /find is usually a cache read. When someone's interests change,
+only their own entry is thrown away; in everyone else's cached list just
+that one person is re-scored and moved.
+
+Every score comes from score_sets:
+(shared interests / smaller interest count) x 100, rounded down.
+"""
+
+import sys
+import os
+import time
+import heapq
+import threading
+from bisect import insort
+from collections import OrderedDict
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_db import (
+    find_users, get_interest_sets, get_interest_overlap, on_interests_changed, read_view
+)
+from config import Config
+from app.lsh import lsh_index
+
+
+def rank_key(item):
+    """Sort key for (score, user_id): best score first, then lowest user ID"""
+    return (-item[0], item[1])
+
+
+def score_sets(mine, theirs):
+    """Score two sets of interest IDs"""
+    # The person with fewer interests is the base
+    base_count = min(len(mine), len(theirs))
+    if base_count == 0:
+        return 0
+    return int((len(mine & theirs) / base_count) * 100)
+
+
+def score_candidates(user_id, candidate_ids):
+    """
+    Score a user against a list of candidates.
+
+    Args:
+        user_id: The user looking for a match
+        candidate_ids: IDs of the users to compare them with
+
+    Returns:
+        List of scores (0-100) in the same order as candidate_ids
+    """
+    id_sets = get_interest_sets([user_id, *candidate_ids])
+    mine = id_sets[user_id]
+    return [score_sets(mine, id_sets[candidate_id]) for candidate_id in candidate_ids]
+
+
+def _scored_candidates(user_id, exclude_ids=(), exact=False):
+    """
+    Score the users who share an interest with a user, as (score, user_id).
+    Unless exact is True, in 'lsh' mode that is only the people in the same
+    LSH buckets (once the index is built).
+    """
+    candidate_ids = None
+    if Config.MATCHER == 'lsh' and not exact:
+        candidate_ids = lsh_index.candidates(user_id)
+    if candidate_ids is not None:
+        candidate_ids = [other_id for other_id in candidate_ids if other_id not in exclude_ids]
+        scores = score_candidates(user_id, candidate_ids)
+        return [(score, other_id) for score, other_id in zip(scores, candidate_ids) if score > 0]
+
+    shared = get_interest_overlap(user_id)
+    candidate_ids = [other_id for other_id in shared if other_id not in exclude_ids]
+    id_sets = get_interest_sets([user_id, *candidate_ids])
+    my_count = len(id_sets[user_id])
+
+    scored = []
+    for candidate_id in candidate_ids:
+        base_count = min(my_count, len(id_sets[candidate_id]))
+        score = int((shared[candidate_id] / base_count) * 100)
+        # One shared interest out of more than 100 still rounds down to 0
+        if score > 0:
+            scored.append((score, candidate_id))
+    return scored
+
+
+def rank_candidates(user_id, exclude_ids=(), exact=False, limit=None):
+    """
+    Find and score the users who share at least one interest with a user.
+
+    Args:
+        user_id: The user looking for a match
+        exclude_ids: IDs to leave out (e.g. people already matched)
+        exact: Score everyone who shares an interest, also in 'lsh' mode
+        limit: Only return the best this many (None: all of them)
+
+    Returns:
+        List of (score, user_id) with a score above 0, best first.
+        Equal scores are ordered by user ID.
+    """
+    scored = _scored_candidates(user_id, exclude_ids, exact)
+    if limit is None:
+        return sorted(scored, key=rank_key)
+    # A heap only puts the best limit in order
+    return heapq.nsmallest(limit, scored, key=rank_key)
+
+
+def _zero_tier(user_id, exclude_ids, after_id, count, scored_ids=None):
+    """
+    Get the next count people after after_id, by ID, who score 0 with a
+    user, as (0, user_id). scored_ids are everyone who scores above 0, if
+    known; otherwise each person's interests are checked.
+    """
+    found = []
+    while len(found) < count:
+        # Count user IDs up from where we are, like an empty search does
+        batch, more = find_users('', except_user_id=user_id, after=(0, after_id), limit=max(count, 100))
+        other_ids = [user['id'] for tier, user in batch if user['id'] not in exclude_ids]
+        if scored_ids is None:
+            id_sets = get_interest_sets([user_id, *other_ids])
+            other_ids = [other_id for other_id in other_ids
+                         if score_sets(id_sets[user_id], id_sets[other_id]) == 0]
+        else:
+            other_ids = [other_id for other_id in other_ids if other_id not in scored_ids]
+        found += [(0, other_id) for other_id in other_ids]
+        if not more:
+            break
+        after_id = batch[-1][1]['id']
+    return found[:count]
+
+
+def feed_page(user_id, exclude_ids=(), after=None, limit=20):
+    """
+    Get one page of a user's candidate feed.
+
+    The feed is everyone except the user and exclude_ids: first the people
+    who share an interest with them, best score first, then everyone else
+    with a score of 0, by user ID. Pages are found with a heap (only the
+    next limit entries are put in order), and the first ones usually come
+    straight from the recommendations cache. The people with a score of 0
+    are found by counting user IDs up from the cursor, so a page there
+    only reads about as many people as it shows.
+
+    Args:
+        user_id: The user looking for a match
+        exclude_ids: IDs to leave out (e.g. people already matched)
+        after: The (score, user_id) the previous page ended with, or None
+        limit: How many candidates to return
+
+    Returns:
+        (page, has_more) where page is a list of (score, user_id)
+    """
+    after_key = rank_key(after) if after else None
+
+    def wanted(item):
+        return item[1] not in exclude_ids and (after_key is None or rank_key(item) > after_key)
+
+    # People with a score go first
+    page = []
+    # Everyone who scores above 0, when we know it already
+    positive_ids = None
+    if after is None or after[0] > 0:
+        ranked, complete = recommendations.get(user_id)
+        page = [item for item in ranked if wanted(item)][:limit + 1]
+        if complete:
+            positive_ids = {item[1] for item in ranked}
+        elif len(page) <= limit:
+            # The cache ran out - score everyone who shares an interest
+            scored = _scored_candidates(user_id, exact=True)
+            positive_ids = {item[1] for item in scored}
+            page = heapq.nsmallest(limit + 1, filter(wanted, scored), key=rank_key)
+
+    # Then everyone else, as long as there is room on the page
+    if len(page) <= limit:
+        after_id = after[1] if after and after[0] == 0 else 0
+        page += _zero_tier(user_id, exclude_ids, after_id, limit + 1 - len(page), positive_ids)
+
+    return page[:limit], len(page) > limit
+
+
+class RecommendationCache:
+    """
+    Least recently used cache of each user's best candidates.
+
+    An entry is the start of the user's rank_candidates list (at most
+    top_k long), and whether that is the whole list. Entries are kept
+    correct as interests change:
+    - the user who changed loses their own entry
+    - in every other entry, that user is taken out, re-scored and put back
+      in order if they still belong in the top part of the list
+
+    Changes are only noted when they are reported (that can happen while
+    the database is locked) and applied at the next lookup.
+    """
+
+    def __init__(self, size, top_k, ttl):
+        self.size = size
+        self.top_k = top_k
+        self.ttl = ttl
+        # user_id -> (time computed, [(score, user_id), ...], complete)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Changes not applied yet - None in the set means "everything" -
+        # and how many have been noted, so a ranking that raced with a
+        # change isn't remembered
+        self._changed = set()
+        self._changed_lock = threading.Lock()
+        self._version = 0
+
+    def interests_changed(self, user_id):
+        """Take note that a user's interests changed (None: anyone's may have)"""
+        with self._changed_lock:
+            self._changed.add(user_id)
+            self._version += 1
+
+    def get(self, user_id):
+        """
+        Get a user's best candidates as (ranked, complete): ranked is a list
+        of (score, user_id), best first, and complete is False if there may
+        be more candidates after it.
+        """
+        # Starting the view catches up with other processes' changes first,
+        # and taking it before our own lock keeps the lock order the same
+        # as in the routes (database, then cache)
+        with read_view():
+            with self._lock:
+                self._apply_changes()
+                entry = self._entries.get(user_id)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    self._entries.move_to_end(user_id)
+                    return entry[1], entry[2]
+                with self._changed_lock:
+                    version = self._version
+
+            # Ranking is the slow part - other lookups carry on meanwhile
+            # One more than we keep tells whether there are more
+            ranked = rank_candidates(user_id, limit=self.top_k + 1)
+            # LSH candidates are only some of the people who score
+            complete = len(ranked) <= self.top_k and Config.MATCHER != 'lsh'
+            ranked = ranked[:self.top_k]
+
+            with self._lock:
+                # A change noted since may not be in what we ranked
+                if self._version == version:
+                    self._entries[user_id] = (time.monotonic(), ranked, complete)
+                    self._entries.move_to_end(user_id)
+                    if len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+            return ranked, complete
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._entries.clear()
+
+    def _apply_changes(self):
+        with self._changed_lock:
+            changed, self._changed = self._changed, set()
+        if not changed:
+            return
+        if None in changed:
+            self._entries.clear()
+            return
+
+        # The people who changed have to be ranked again from scratch
+        for user_id in changed:
+            self._entries.pop(user_id, None)
+        if not self._entries:
+            return
+
+        # Everyone else only needs the people who changed re-scored
+        id_sets = get_interest_sets([*changed, *self._entries])
+        for owner_id, (computed_at, ranked, complete) in list(self._entries.items()):
+            ranked = [item for item in ranked if item[1] not in changed]
+            for user_id in changed:
+                score = score_sets(id_sets[owner_id], id_sets[user_id])
+                if score == 0:
+                    continue
+                item = (score, user_id)
+                # Past the end of a partial list we don't know where it goes
+                if complete or (ranked and rank_key(item) < rank_key(ranked[-1])):
+                    insort(ranked, item, key=rank_key)
+            if len(ranked) > self.top_k:
+                ranked = ranked[:self.top_k]
+                complete = False
+            if ranked or complete:
+                self._entries[owner_id] = (computed_at, ranked, complete)
+            else:
+                del self._entries[owner_id]
+
+
+recommendations = RecommendationCache(
+    Config.RECOMMENDATION_CACHE_SIZE,
+    Config.RECOMMENDATION_TOP_K,
+    Config.RECOMMENDATION_CACHE_TTL
+)
+on_interests_changed(recommendations.interests_changed)
+# Entries ranked while the LSH index was being built came from other candidates
+lsh_index.on_built(lambda: recommendations.interests_changed(None))
@@ -8,6 +8,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from json_db import create_user, verify_user, get_user_by_id
+from passwords import PasswordQueueFull
 from app.utils import generate_token
 
 # Create a blueprint for auth routes
@@ -30,7 +31,12 @@ def signup():
     name = data.get('name')
     
     # Create user (automatically matches with Maddie)
-    new_user = create_user(email, password, name)
+    # Hashing the password waits for the password workers - if too many
+    # signups and logins are waiting already, ask the client to retry
+    try:
+        new_user = create_user(email, password, name)
+    except PasswordQueueFull:
+        return jsonify({'error': 'Server is busy, please try again in a moment'}), 503
     
     if not new_user:
         return jsonify({'error': 'User already exists'}), 400
@@ -67,8 +73,11 @@ def login():
     email = data.get('email')
     password = data.get('password')
     
-    # Verify user
-    user = verify_user(email, password)
+    # Verify user (on the password workers, like signup)
+    try:
+        user = verify_user(email, password)
+    except PasswordQueueFull:
+        return jsonify({'error': 'Server is busy, please try again in a moment'}), 503
     
     if not user:
         return jsonify({'error': 'Invalid email or password'}), 401
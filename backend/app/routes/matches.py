@@ -5,14 +5,17 @@ Uses JSON database.
 GET /current: Returns all your active matches 
 GET /past: Returns all your archived matches
 POST /find: Finds and returns one new potential match for you
+GET /feed: Returns a page of potential matches, best first, with a cursor for the next page
+GET /dashboard: Returns current matches, past matches and note previews in one request
 POST /accept: Creates a match record when you accept/like someone
-POST /decline: Does nothing, just returns success if the match has been delcined
+POST /decline: Remembers that you declined someone, so they aren't suggested again for a while
 POST /archive: Moves an active match to past matches (sets is_active=False)
 
 The Matching Algorithm: 
 
-Gets all users except the current and anyone already matched with
-For each available user, calculates a compatibility score based on shared interests only
+Gets the users who share at least one interest with you, except anyone already matched with
+or recently declined
+For each of them, calculates a compatibility score based on shared interests only
 works with the lowest of the two 
 The score formula: (shared interests / smaller interest count) × 100
 
@@ -20,6 +23,7 @@ Example: You have 4 interests, they have 3, you share 2 → (2/3) × 100 = 67%
 
 
 Returns the user with the highest score as your match
+(if nobody shares an interest with you, the first available user)
 
 The matching algorithm prioritizes people with similar interests, calculating a 
 compatibility score from 0-100% based on how many interests they share.
@@ -32,58 +36,40 @@ import os
 # and this file is in backend/app/routes/
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from json_db import (
-    get_user_by_id, get_all_users, get_user_matches, 
-    create_match, archive_match, get_user_interests
+    get_user_by_id, get_users_by_ids, get_all_users, get_user_matches, 
+    create_match, archive_match, read_view,
+    decline_user, get_declined_user_ids, get_match_notes
 )
 from app.utils import require_auth
+from app.matching import rank_candidates, recommendations, feed_page
 
 # Create a blueprint for match routes - groups all matching-related endpoints together
 # When registered in main app, all these routes will be prefixed (like /api/matches)
 bp = Blueprint('matches', __name__)
 
-def calculate_match_score(user1, user2):
+def get_excluded_user_ids(user_id):
     """
-    Calculate how well two users match based on shared interests.
-    
-    The algorithm works by finding common interests and calculating what percentage
-    of interests they share. We use the person with FEWER interests as the base
-    to avoid penalizing people who have many interests.
-    
-    Example: 
-    - User A likes: ['hiking', 'cooking', 'music'] (3 interests)
-    - User B likes: ['hiking', 'music', 'reading', 'gaming', 'art'] (5 interests)
-    - Shared: ['hiking', 'music'] (2 interests)
-    - Score: 2/3 = 66% (using User A's count as base since it's smaller)
-    
-    Returns: Integer from 0-100 representing match percentage
+    Get the IDs of everyone who shouldn't be suggested to a user:
+    people they're currently matched with and people they declined.
     """
     
-    # Convert lists to sets for efficient comparison
-    # Sets allow us to use intersection() to find common elements quickly
-    user1_interests = set(get_user_interests(user1['id']))
-    user2_interests = set(get_user_interests(user2['id']))
-    
-    # Find shared interests using set intersection
-    # This gives us all interests that appear in BOTH sets
-    shared_interests = user1_interests.intersection(user2_interests)
-    
-    # Choose the smaller set as our base for percentage calculation
-    # This prevents unfair scoring - if someone has 20 interests and shares 3,
-    # that's still a good match for someone who only has 3 interests total
-    if len(user1_interests) <= len(user2_interests):
-        base_count = len(user1_interests)
-    else:
-        base_count = len(user2_interests)
+    # Get all your current active matches (not archived ones)
+    # active_only=True means we ignore past/archived matches
+    existing_matches = get_user_matches(user_id, active_only=True)
     
-    # Calculate percentage, handling edge case where someone has no interests
-    if base_count == 0:
-        score = 0
-    else:
-        # Convert to percentage and round to integer
-        # Example: 2 shared / 3 total = 0.666... = 66%
-        score = int((len(shared_interests) / base_count) * 100)
+    # Build a set of user IDs we're already matched with
+    # We need to check both user1_id and user2_id because we could be either one
+    matched_user_ids = set()
+    for match in existing_matches:
+        # If we're user1 in this match, the other person is user2
+        if match['user1_id'] == user_id:
+            matched_user_ids.add(match['user2_id'])
+        # If we're user2 in this match, the other person is user1
+        else:
+            matched_user_ids.add(match['user1_id'])
     
-    return score
+    # Recent declines are a small list kept per user, no scan needed
+    return matched_user_ids | get_declined_user_ids(user_id)
 
 
 @bp.route('/find', methods=['POST'])
@@ -96,10 +82,10 @@ def find_match():
     that the user hasn't been matched with yet.
     
     Process:
-    1. Get all users except yourself
-    2. Filter out people you're already matched with
-    3. Calculate compatibility scores with everyone remaining
-    4. Return the highest scoring match
+    1. Get the people you're already matched with or declined
+    2. Find everyone else who shares an interest with you
+    3. Calculate compatibility scores with them
+    4. Return the highest scoring match (or the first available user if nobody scores)
     
     POST because this is an action (finding) not just retrieving data
     Each call might return different results as new users join
@@ -109,52 +95,50 @@ def find_match():
     # This was added by @require_auth decorator
     current_user = request.current_user
     
-    # Get all users except yourself (can't match with yourself!)
-    all_users = get_all_users(except_user_id=current_user['id'])
-    
-    # Get all your current active matches (not archived ones)
-    # active_only=True means we ignore past/archived matches
-    existing_matches = get_user_matches(current_user['id'], active_only=True)
-    
-    # Build a set of user IDs we're already matched with
-    # We need to check both user1_id and user2_id because we could be either one
-    matched_user_ids = set()
-    for match in existing_matches:
-        # If we're user1 in this match, the other person is user2
-        if match['user1_id'] == current_user['id']:
-            matched_user_ids.add(match['user2_id'])
-        # If we're user2 in this match, the other person is user1
-        else:
-            matched_user_ids.add(match['user1_id'])
-    
-    # Filter out users we're already matched with using list comprehension
-    # This gives us only "fresh" users we haven't connected with yet
-    available_users = [user for user in all_users if user['id'] not in matched_user_ids]
-    
-    # Handle edge case: what if everyone is already matched?
-    if not available_users:
-        # Return 404 (Not Found) since there's no match resource available
-        return jsonify({'error': 'No available users to match with'}), 404
-    
-    # Find the best match by checking compatibility with each available user
-    # This is a classic "find the maximum" algorithm
-    best_match = None  # Will store the user object of best match
-    best_score = 0     # Will store their compatibility score
-    
-    # Loop through all available users and calculate scores
-    for user in available_users:
-        score = calculate_match_score(current_user, user)
-        # If this user has a higher score than our current best, update
-        if score > best_score:
-            best_score = score
-            best_match = user
-    
-    # Fallback: if no one has common interests (all scores are 0),
-    # just pick the first available user so user always gets someone
-    if not best_match:
-        best_match = available_users[0]
-        # Still calculate their score (will be 0) for consistency
-        best_score = calculate_match_score(current_user, best_match)
+    # Read everything from one consistent view of the database,
+    # so a signup or new match halfway through can't mix things up
+    with read_view():
+        # Everyone you're already matched with (active matches only)
+        # or declined recently
+        excluded_user_ids = get_excluded_user_ids(current_user['id'])
+        
+        # Only people who share an interest with you can score above 0.
+        # Your best candidates are usually cached already, best first
+        ranked, complete = recommendations.get(current_user['id'])
+        ranked = [item for item in ranked if item[1] not in excluded_user_ids]
+        if not ranked and not complete:
+            # Everyone cached is matched or declined already - score the rest
+            # (just the people who share an interest with you, all of them
+            # even with the LSH matcher, so nobody who scores is passed over)
+            ranked = rank_candidates(current_user['id'], exclude_ids=excluded_user_ids, exact=True)
+        
+        # Take the best one that still has an account
+        best_match = None  # Will store the user object of best match
+        best_score = 0     # Will store their compatibility score
+        for score, user_id in ranked:
+            user = get_user_by_id(user_id)
+            if user:
+                best_match = user
+                best_score = score
+                break
+        
+        # Fallback: if no one has common interests (all scores are 0),
+        # just pick the first available user so user always gets someone
+        if not best_match:
+            # Get all users except yourself (can't match with yourself!)
+            all_users = get_all_users(except_user_id=current_user['id'])
+            
+            # Filter out users we're already matched with or declined using list comprehension
+            # This gives us only "fresh" users we haven't connected with yet
+            available_users = [user for user in all_users if user['id'] not in excluded_user_ids]
+            
+            # Handle edge case: what if everyone is already matched or declined?
+            if not available_users:
+                # Return 404 (Not Found) since there's no match resource available
+                return jsonify({'error': 'No available users to match with'}), 404
+            
+            best_match = available_users[0]
+            best_score = 0
     
     # Build the response with the matched user's data
     # We send all their public info plus the calculated match score
@@ -171,6 +155,76 @@ def find_match():
     return jsonify(match_data), 200
 
 
+@bp.route('/feed', methods=['GET'])
+@require_auth
+def get_match_feed():
+    """
+    Get a page of potential matches, best first.
+    
+    /find returns one person per request, so every swipe is a round trip
+    and a new scoring pass. The feed returns the next `limit` people in
+    the same order /find would pick them (highest score first, then
+    everyone who scores 0), so one request covers a whole run of swipes.
+    
+    Query parameters:
+    - limit: how many people to return (default 20, at most 50)
+    - cursor: the next_cursor from the previous page, to continue after it
+    
+    The cursor is the score and ID of the last person on the page, not a
+    position. So accepting or declining people from a page doesn't shift
+    the next one - it continues right after where the last page ended.
+    
+    Returns: {'users': [...], 'next_cursor': string, or null on the last page}
+    """
+    
+    current_user = request.current_user
+    
+    # Read and check the query parameters
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    limit = max(1, min(limit, 50))
+    
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        # The cursor looks like "<score>:<user id>"
+        try:
+            score, user_id = cursor.split(':')
+            after = (int(score), int(user_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    with read_view():
+        # People you're already matched with or declined don't show up
+        excluded_user_ids = get_excluded_user_ids(current_user['id'])
+        page, has_more = feed_page(current_user['id'], exclude_ids=excluded_user_ids,
+                                   after=after, limit=limit)
+        
+        # Same fields as /find returns for one person
+        page_users = get_users_by_ids([user_id for score, user_id in page])
+        users = []
+        for score, user_id in page:
+            user = page_users.get(user_id)
+            if user:
+                users.append({
+                    'id': user['id'],
+                    'email': user['email'],
+                    'name': user['name'],
+                    'bio': user.get('bio', ''),
+                    'profile_picture': user.get('profile_picture'),
+                    'match_score': score
+                })
+    
+    # The next page starts after the last person on this one
+    next_cursor = None
+    if has_more:
+        next_cursor = '%d:%d' % page[-1]
+    
+    return jsonify({'users': users, 'next_cursor': next_cursor}), 200
+
+
 @bp.route('/accept', methods=['POST'])
 @require_auth
 def accept_match():
@@ -210,19 +264,153 @@ def decline_match():
     """
     Decline a match - like swiping left.
     
-    Interestingly, we DON'T store declined matches. This means:
-    - Database stays smaller (no "rejection" records)
-    - Users might see the same person again later
-    - People get second chances if interests change
-    - More privacy-friendly (no permanent rejection list)
+    We remember who you declined so /find and the feed stop showing them.
+    Declines are kept small on purpose:
+    - Only the most recent ones are kept (Config.DECLINE_MEMORY_SIZE per user)
+    - They are forgotten after Config.DECLINE_EXPIRY_DAYS, so people
+      get second chances, e.g. if their interests change
+    
+    Frontend sends:
+    - user_id: ID of the person being declined
     
-    POST because it's an action, even though we don't store anything
+    POST because it's an action
     """
     
-    # Just return success - we don't actually do anything with declines
+    # Get the authenticated user
+    current_user = request.current_user
+    
+    # Remember the decline (nothing to remember without a user_id)
+    data = request.get_json(silent=True) or {}
+    declined_user_id = data.get('user_id')
+    if declined_user_id is not None:
+        try:
+            declined_user_id = int(declined_user_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'user_id must be a number'}), 400
+        decline_user(current_user['id'], declined_user_id)
+    
     return jsonify({'message': 'Match declined'}), 200
 
 
+def get_other_user_id(match, user_id):
+    """
+    Figure out who the OTHER person in a match is.
+    Match records have user1_id and user2_id - we need the one that's NOT us.
+    """
+    if match['user1_id'] == user_id:
+        # We're user1, so it's user2
+        return match['user2_id']
+    # We're user2, so it's user1
+    return match['user1_id']
+
+
+def hydrate_matches(matches, user_id):
+    """
+    Pair each match with the other person in it.
+    
+    Everyone is looked up in one go (get_users_by_ids) rather than once per
+    match, so a long match list is a single pass over the users.
+    Matches whose other person no longer exists are left out (handles
+    deleted accounts).
+    
+    Returns: list of (match, other_user), in the order of matches
+    """
+    other_users = get_users_by_ids({get_other_user_id(match, user_id) for match in matches})
+    hydrated = []
+    for match in matches:
+        other_user = other_users.get(get_other_user_id(match, user_id))
+        if other_user:
+            hydrated.append((match, other_user))
+    return hydrated
+
+
+def current_match_data(match, other_user):
+    """
+    Build what /current (and the dashboard) shows for an active match:
+    the other person's info + match metadata.
+    """
+    return {
+        # User's basic information
+        'id': other_user['id'],
+        'email': other_user['email'],
+        'name': other_user['name'],
+        'bio': other_user.get('bio', ''),
+        'profile_picture': other_user.get('profile_picture'),
+        
+        # Match-specific information
+        'match_id': match['id'],  # Important! Used for notes, archiving, etc.
+        'match_score': match.get('match_score', 0),  # Compatibility percentage
+        'match_date': match.get('created_at', ''),  # When you matched
+        'scheduled': False  # Placeholder for future scheduling feature
+    }
+
+
+def past_match_data(match, other_user):
+    """
+    Build what /past (and the dashboard) shows for an archived match -
+    similar to current but with archived_date.
+    """
+    return {
+        'id': other_user['id'],
+        'email': other_user['email'],
+        'name': other_user['name'],
+        'bio': other_user.get('bio', ''),
+        'profile_picture': other_user.get('profile_picture'),
+        'match_id': match['id'],
+        'archived_date': match.get('archived_at', '')  # When it was archived
+        # Note: no match_score or match_date here - keeping response lighter
+    }
+
+
+# How much of each note the dashboard shows (the editor loads all of it)
+NOTE_PREVIEW_LENGTH = 200
+
+
+@bp.route('/dashboard', methods=['GET'])
+@require_auth
+def get_dashboard():
+    """
+    Get everything the dashboard shows in one request.
+    
+    The dashboard used to call /current, then /past, then /notes for each
+    match - every call authenticating and reading the database again.
+    This returns the same current and past match lists, plus the start of
+    your note for each match, all read from one consistent view.
+    
+    Returns: {'current': [...], 'past': [...]}, each match with a 'notes'
+    preview and 'notes_truncated' (True if the note goes on after it)
+    """
+    
+    # Get the authenticated user
+    current_user = request.current_user
+    
+    # Read everything from one consistent view of the database
+    with read_view():
+        # All matches, active and archived, and your notes on them in one go
+        matches = get_user_matches(current_user['id'], active_only=False)
+        notes = get_match_notes([match['id'] for match in matches], current_user['id'])
+        
+        current_list = []
+        past_list = []
+        
+        for match, other_user in hydrate_matches(matches, current_user['id']):
+            # Same fields as /current or /past, depending on the match
+            if match.get('is_active', True):
+                match_data = current_match_data(match, other_user)
+                current_list.append(match_data)
+            else:
+                match_data = past_match_data(match, other_user)
+                past_list.append(match_data)
+            
+            # Just a preview of the note - it can be long
+            note = notes.get(match['id'])
+            note_text = note['note_text'] if note else ''
+            match_data['notes'] = note_text[:NOTE_PREVIEW_LENGTH]
+            match_data['notes_truncated'] = len(note_text) > NOTE_PREVIEW_LENGTH
+    
+    return jsonify({'current': current_list, 'past': past_list}), 200
+
+
 @bp.route('/current', methods=['GET'])
 @require_auth
 def get_current_matches():
@@ -242,42 +430,18 @@ def get_current_matches():
     # Get the authenticated user
     current_user = request.current_user
     
-    # Get all active matches (not archived ones)
-    # active_only=True filters out past/archived matches
-    matches = get_user_matches(current_user['id'], active_only=True)
-    
-    # Build the response list with details about each match
-    matches_list = []
-    
-    # Loop through each match record
-    for match in matches:
-        # Figure out who the OTHER person in this match is
-        # Match records have user1_id and user2_id - we need the one that's NOT us
-        if match['user1_id'] == current_user['id']:
-            # We're user1, so get user2
-            other_user = get_user_by_id(match['user2_id'])
-        else:
-            # We're user2, so get user1
-            other_user = get_user_by_id(match['user1_id'])
+    # Read everything from one consistent view of the database
+    with read_view():
+        # Get all active matches (not archived ones)
+        # active_only=True filters out past/archived matches
+        matches = get_user_matches(current_user['id'], active_only=True)
         
-        # Only add to list if user still exists (handles deleted accounts)
-        if other_user:
-            # Build match data combining user info + match metadata
-            match_data = {
-                # User's basic information
-                'id': other_user['id'],
-                'email': other_user['email'],
-                'name': other_user['name'],
-                'bio': other_user.get('bio', ''),
-                'profile_picture': other_user.get('profile_picture'),
-                
-                # Match-specific information
-                'match_id': match['id'],  # Important! Used for notes, archiving, etc.
-                'match_score': match.get('match_score', 0),  # Compatibility percentage
-                'match_date': match.get('created_at', ''),  # When you matched
-                'scheduled': False  # Placeholder for future scheduling feature
-            }
-            matches_list.append(match_data)
+        # Build the response list with details about each match,
+        # looking up the OTHER person in every match in one go
+        matches_list = [
+            current_match_data(match, other_user)
+            for match, other_user in hydrate_matches(matches, current_user['id'])
+        ]
     
     # Return the list with 200 (OK) status
     return jsonify(matches_list), 200
@@ -334,40 +498,23 @@ def get_past_matches():
     # Get the authenticated user
     current_user = request.current_user
     
-    # Get ALL matches including archived ones
-    # active_only=False means we get both active AND inactive matches
-    matches = get_user_matches(current_user['id'], active_only=False)
-    
-    # Filter to get ONLY the archived (inactive) matches
-    # The .get('is_active', True) handles old data that might not have this field
-    # If is_active doesn't exist, we assume it's active (True), so 'not True' = False
-    archived_matches = [m for m in matches if not m.get('is_active', True)]
-    
-    # Build the response list with archived match details
-    matches_list = []
-    
-    # Loop through each archived match
-    for match in archived_matches:
-        # Same logic as current matches - figure out who the other person is
-        if match['user1_id'] == current_user['id']:
-            other_user = get_user_by_id(match['user2_id'])
-        else:
-            other_user = get_user_by_id(match['user1_id'])
+    # Read everything from one consistent view of the database
+    with read_view():
+        # Get ALL matches including archived ones
+        # active_only=False means we get both active AND inactive matches
+        matches = get_user_matches(current_user['id'], active_only=False)
         
-        # Only add if user still exists
-        if other_user:
-            # Build match data - similar to current but with archived_date
-            match_data = {
-                'id': other_user['id'],
-                'email': other_user['email'],
-                'name': other_user['name'],
-                'bio': other_user.get('bio', ''),
-                'profile_picture': other_user.get('profile_picture'),
-                'match_id': match['id'],
-                'archived_date': match.get('archived_at', '')  # When it was archived
-                # Note: no match_score or match_date here - keeping response lighter
-            }
-            matches_list.append(match_data)
+        # Filter to get ONLY the archived (inactive) matches
+        # The .get('is_active', True) handles old data that might not have this field
+        # If is_active doesn't exist, we assume it's active (True), so 'not True' = False
+        archived_matches = [m for m in matches if not m.get('is_active', True)]
+        
+        # Build the response list with archived match details -
+        # same lookup as current matches
+        matches_list = [
+            past_match_data(match, other_user)
+            for match, other_user in hydrate_matches(archived_matches, current_user['id'])
+        ]
     
     # Return the list with 200 (OK) status
     return jsonify(matches_list), 200
\ No newline at end of file
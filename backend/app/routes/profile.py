@@ -14,7 +14,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Imports functions for user data management and interest handling
-from json_db import get_user_by_id, update_user, get_user_interests, set_user_interests
+from json_db import get_user_by_id, update_user, get_user_interests, set_user_interests, transaction
 from app.utils import require_auth
 
 # Create a blueprint for profile routes
@@ -80,19 +80,21 @@ def update_profile():
     if 'profile_picture' in data:
         update_data['profile_picture'] = data['profile_picture']
     
-    # Update user
-    # if the user needs to be updated, update it
-    if update_data:
-        update_user(user['id'], **update_data)
-    
-    # Update interests if provided
-    # handles the replacement of the interests separately
-    if 'interests' in data:
-        set_user_interests(user['id'], data['interests'])
-    
-    # Get updated user
-    updated_user = get_user_by_id(user['id'])
-    interests = get_user_interests(user['id'])
+    # Save the changes together so nobody sees a half-updated profile
+    with transaction():
+        # Update user
+        # if the user needs to be updated, update it
+        if update_data:
+            update_user(user['id'], **update_data)
+        
+        # Update interests if provided
+        # handles the replacement of the interests separately
+        if 'interests' in data:
+            set_user_interests(user['id'], data['interests'])
+        
+        # Get updated user
+        updated_user = get_user_by_id(user['id'])
+        interests = get_user_interests(user['id'])
     
     # Return updated user data
     # fetching the new data
@@ -134,18 +136,20 @@ def complete_onboarding():
     if 'profile_picture' in data:
         update_data['profile_picture'] = data.get('profile_picture')
     
-    if update_data:
-        # updates the user data
-        update_user(user['id'], **update_data)
-    
-    # Update interests
-    # updates interests separately
-    if 'interests' in data:
-        set_user_interests(user['id'], data.get('interests', []))
-    
-    # Get updated user
-    updated_user = get_user_by_id(user['id'])
-    interests = get_user_interests(user['id'])
+    # Save the changes together so nobody sees a half-updated profile
+    with transaction():
+        if update_data:
+            # updates the user data
+            update_user(user['id'], **update_data)
+        
+        # Update interests
+        # updates interests separately
+        if 'interests' in data:
+            set_user_interests(user['id'], data.get('interests', []))
+        
+        # Get updated user
+        updated_user = get_user_by_id(user['id'])
+        interests = get_user_interests(user['id'])
     
     # Return updated user data
     user_data = {
@@ -8,10 +8,11 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from json_db import (
-    get_all_users, get_user_by_id, follow_user, unfollow_user,
-    is_following, get_follower_count, get_following_count, get_user_interests
+    find_users, get_user_by_id, get_users_by_ids, follow_user, unfollow_user,
+    get_follow_stats, get_user_interests, read_view
 )
 from app.utils import require_auth
+from app.suggestions import suggestions
 
 # Create a blueprint for search routes
 bp = Blueprint('search', __name__)
@@ -21,43 +22,128 @@ bp = Blueprint('search', __name__)
 @require_auth
 def search_users():
     """
-    Search for users by name or email.
-    If no query, returns all users.
+    Search for users by name or email, a page at a time.
+    Results are ranked: names or emails starting with the query first,
+    then names with a word starting with it, then other matches (each by
+    name). If no query, returns all users, by ID.
+    
+    Query parameters:
+    - q: what to search for
+    - limit: how many users to return (default 20, at most 50)
+    - cursor: the next_cursor from the previous page, to continue after it
+    
+    Returns: {'users': [...], 'next_cursor': string, or null on the last page}
     """
     
     # Get current user
     current_user = request.current_user
     
     # Get search query from URL
-    query = request.args.get('q', '').lower()
+    query = request.args.get('q', '').strip().lower()
+    
+    # Read and check the paging parameters
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    limit = max(1, min(limit, 50))
+    
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        # The cursor looks like "<rank>:<user id>"
+        try:
+            tier, user_id = cursor.split(':')
+            after = (int(tier), int(user_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    # Read everything from one consistent view of the database
+    with read_view():
+        # Look the query up in the search index (everyone if no query)
+        page, has_more = find_users(query, except_user_id=current_user['id'],
+                                    after=after, limit=limit)
+        
+        # Follow numbers of just the users on this page, in one go
+        follow_stats = get_follow_stats(current_user['id'], [user['id'] for tier, user in page])
+        
+        # Build list of users
+        users_list = []
+        
+        for tier, user in page:
+            stats = follow_stats[user['id']]
+            user_data = {
+                'id': user['id'],
+                'email': user['email'],
+                'name': user['name'],
+                'bio': user.get('bio', ''),
+                'profile_picture': user.get('profile_picture'),
+                'is_following': stats['is_following'],
+                'followers': stats['followers'],
+                'following': stats['following']
+            }
+            users_list.append(user_data)
+    
+    # The next page starts after the last user on this one
+    next_cursor = None
+    if has_more:
+        tier, user = page[-1]
+        next_cursor = '%d:%d' % (tier, user['id'])
+    
+    return jsonify({'users': users_list, 'next_cursor': next_cursor}), 200
+
+
+@bp.route('/suggestions', methods=['GET'])
+@require_auth
+def get_suggestions():
+    """
+    People you may know: people followed by the people you follow, most
+    mutual follows first (see app/suggestions.py).
     
-    # Get all users except current user
-    all_users = get_all_users(except_user_id=current_user['id'])
+    Query parameters:
+    - limit: how many people to return (default 10, at most 50)
     
-    # Filter by query if provided
-    if query:
-        users = [
-            u for u in all_users
-            if query in u['name'].lower() or query in u['email'].lower()
-        ]
-    else:
-        users = all_users
+    Returns: list of users, each with 'mutual_follows'
+    """
     
-    # Build list of users
-    users_list = []
+    # Get current user
+    current_user = request.current_user
     
-    for user in users:
-        user_data = {
-            'id': user['id'],
-            'email': user['email'],
-            'name': user['name'],
-            'bio': user.get('bio', ''),
-            'profile_picture': user.get('profile_picture'),
-            'is_following': is_following(current_user['id'], user['id']),
-            'followers': get_follower_count(user['id']),
-            'following': get_following_count(user['id'])
-        }
-        users_list.append(user_data)
+    # Read and check the limit
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    limit = max(1, min(limit, 50))
+    
+    # Read everything from one consistent view of the database
+    with read_view():
+        ranked = suggestions.get(current_user['id'])[:limit]
+        
+        # Everyone suggested and their follow numbers, in one go
+        suggested_ids = [user_id for mutual, user_id in ranked]
+        users = get_users_by_ids(suggested_ids)
+        follow_stats = get_follow_stats(current_user['id'], suggested_ids)
+        
+        # Build list of users
+        users_list = []
+        
+        for mutual, user_id in ranked:
+            user = users.get(user_id)
+            if not user:
+                continue
+            stats = follow_stats[user_id]
+            users_list.append({
+                'id': user['id'],
+                'email': user['email'],
+                'name': user['name'],
+                'bio': user.get('bio', ''),
+                'profile_picture': user.get('profile_picture'),
+                'mutual_follows': mutual,
+                'is_following': stats['is_following'],
+                'followers': stats['followers'],
+                'following': stats['following']
+            })
     
     return jsonify(users_list), 200
 
@@ -114,27 +200,32 @@ def get_user_profile(user_id):
     # Get current user
     current_user = request.current_user
     
-    # Get the user
-    user = get_user_by_id(user_id)
-    
-    # Check if user exists
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    
-    # Get interests
-    interests = get_user_interests(user_id)
-    
-    # Get user data
-    user_data = {
-        'id': user['id'],
-        'email': user['email'],
-        'name': user['name'],
-        'bio': user.get('bio', ''),
-        'profile_picture': user.get('profile_picture'),
-        'interests': interests,
-        'is_following': is_following(current_user['id'], user_id),
-        'followers': get_follower_count(user_id),
-        'following': get_following_count(user_id)
-    }
+    # Read everything from one consistent view of the database
+    with read_view():
+        # Get the user
+        user = get_user_by_id(user_id)
+        
+        # Check if user exists
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Get interests
+        interests = get_user_interests(user_id)
+        
+        # Get follow numbers
+        stats = get_follow_stats(current_user['id'], [user_id])[user_id]
+        
+        # Get user data
+        user_data = {
+            'id': user['id'],
+            'email': user['email'],
+            'name': user['name'],
+            'bio': user.get('bio', ''),
+            'profile_picture': user.get('profile_picture'),
+            'interests': interests,
+            'is_following': stats['is_following'],
+            'followers': stats['followers'],
+            'following': stats['following']
+        }
     
     return jsonify(user_data), 200
@@ -0,0 +1,134 @@
+"""
+"People you may know" - suggestions from the follow graph.
+
+The people suggested to you are the ones followed by people you follow
+(but not by you yet), ranked by how many of the people you follow follow
+them: their mutual follows. The walk is only two steps deep, over the
+adjacency sets the database keeps (get_following_ids), so its cost
+depends on how many follows your own follows have, not on the number of
+users or follows overall.
+
+suggestions keeps the result in memory per user. An entry is thrown away
+when the user, or anyone they follow, follows or unfollows someone -
+those are the only changes that can affect it.
+"""
+
+import sys
+import os
+import time
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from itertools import chain
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_db import get_following_ids, on_follows_changed, read_view
+from config import Config
+
+
+def rank_suggestions(user_id, limit):
+    """
+    Find the people a user may know.
+
+    Args:
+        user_id: The user to suggest people to
+        limit: How many suggestions to return at most
+
+    Returns:
+        (following, ranked) where following is the set of IDs the user
+        follows and ranked is a list of (mutual follows, user_id), most
+        mutual follows first. Equal counts are ordered by user ID.
+    """
+    following = get_following_ids([user_id])[user_id]
+
+    # Step two: everyone the people they follow follow, counted in one go
+    mutual = Counter(chain.from_iterable(get_following_ids(following).values()))
+
+    # Nobody is suggested to themselves, or people they already follow
+    mutual.pop(user_id, None)
+    for followed_id in following:
+        mutual.pop(followed_id, None)
+
+    best = heapq.nsmallest(limit, mutual.items(), key=lambda item: (-item[1], item[0]))
+    return following, [(count, other_id) for other_id, count in best]
+
+
+class SuggestionCache:
+    """
+    Least recently used cache of each user's suggestions.
+
+    An entry is the start of the user's rank_suggestions list (at most
+    top_k long), together with the set of people the user followed when
+    it was made - a follow change by the user or by any of them throws it
+    away. Like the recommendations cache, changes are only noted when they
+    are reported and applied at the next lookup.
+    """
+
+    def __init__(self, size, top_k, ttl):
+        self.size = size
+        self.top_k = top_k
+        self.ttl = ttl
+        # user_id -> (time computed, following, [(mutual follows, user_id), ...])
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Changes not applied yet - None in the set means "everything" -
+        # and how many have been noted, so suggestions that raced with a
+        # change aren't remembered
+        self._changed = set()
+        self._changed_lock = threading.Lock()
+        self._version = 0
+
+    def follows_changed(self, user_id):
+        """Take note that a user followed or unfollowed someone (None: anyone may have)"""
+        with self._changed_lock:
+            self._changed.add(user_id)
+            self._version += 1
+
+    def get(self, user_id):
+        """Get a user's suggestions: a list of (mutual follows, user_id), best first"""
+        # Same lock order as the recommendations cache: database, then cache
+        with read_view():
+            with self._lock:
+                self._apply_changes()
+                entry = self._entries.get(user_id)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    self._entries.move_to_end(user_id)
+                    return entry[2]
+                with self._changed_lock:
+                    version = self._version
+
+            # The walk is the slow part - other lookups carry on meanwhile
+            following, ranked = rank_suggestions(user_id, self.top_k)
+
+            with self._lock:
+                # A change noted since may not be in what we found
+                if self._version == version:
+                    self._entries[user_id] = (time.monotonic(), following, ranked)
+                    self._entries.move_to_end(user_id)
+                    if len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+            return ranked
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._entries.clear()
+
+    def _apply_changes(self):
+        with self._changed_lock:
+            changed, self._changed = self._changed, set()
+        if not changed:
+            return
+        if None in changed:
+            self._entries.clear()
+            return
+        for owner_id, (computed_at, following, ranked) in list(self._entries.items()):
+            if owner_id in changed or not following.isdisjoint(changed):
+                del self._entries[owner_id]
+
+
+suggestions = SuggestionCache(
+    Config.SUGGESTION_CACHE_SIZE,
+    Config.SUGGESTION_TOP_K,
+    Config.SUGGESTION_CACHE_TTL
+)
+on_follows_changed(suggestions.follows_changed)
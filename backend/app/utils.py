@@ -3,12 +3,19 @@ Utility functions - helper functions used throughout the app.
 These are functions we'll use in multiple places.
 """
 
+import sys
+import os
+import time
+import threading
 import jwt
-import bcrypt
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_db import get_user_by_id, on_users_changed, catch_up
 from config import Config
+import passwords
 
 def hash_password(password):
     """
@@ -21,11 +28,9 @@ def hash_password(password):
     Returns:
         The hashed password as a string
     """
-    # Generate a salt and hash the password
-    # Salt adds random data to make passwords more secure
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    # bcrypt runs on the password worker pool (see passwords.py)
+    # with a random salt and Config.BCRYPT_ROUNDS
+    return passwords.hash_password(password)
 
 
 def check_password(password, password_hash):
@@ -39,8 +44,8 @@ def check_password(password, password_hash):
     Returns:
         True if passwords match, False otherwise
     """
-    # Compare the plain password with the hashed password
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    # Compare the plain password with the hashed password, on the worker pool
+    return passwords.check_password(password, password_hash)
 
 
 def generate_token(user_id):
@@ -80,20 +85,126 @@ def verify_token(token):
     Returns:
         The user ID if token is valid, None otherwise
     """
+    decoded = _decode_token(token)
+    return decoded['user_id'] if decoded else None
+
+
+def _decode_token(token):
+    """Check a JWT token's signature and expiry and get its contents (None if invalid)"""
     try:
         # Decode the token using our secret key
-        decoded = jwt.decode(token, Config.SECRET_KEY, algorithms=['HS256'])
-        return decoded['user_id']
+        return jwt.decode(token, Config.SECRET_KEY, algorithms=['HS256'])
     except:
         # If token is invalid or expired, return None
         return None
 
 
+class TimedCache:
+    """
+    A small thread-safe cache where every entry has an expiry time.
+    When it's full, the least recently used entry is dropped.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        # key -> (expires at, value)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Get the value for a key, or None if it isn't there or has expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key, value, expires_at):
+        """Remember a value until expires_at (a time.time() value)"""
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        """Forget a key"""
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._entries.clear()
+
+
+# Tokens require_auth has verified: token -> user ID. An entry never
+# outlives the token itself
+_tokens = TimedCache(Config.AUTH_CACHE_SIZE)
+
+# Users require_auth has looked up: user ID -> user. Entries are dropped
+# when the user changes, in this process or (JSON database) another one.
+# The version goes up whenever a user changes, so a lookup that raced
+# with a change isn't remembered
+_users = TimedCache(Config.AUTH_CACHE_SIZE)
+_users_version = 0
+
+def _user_changed(user_id):
+    """Forget a user who changed (None: anyone may have)"""
+    global _users_version
+    _users_version += 1
+    if user_id is None:
+        _users.clear()
+    else:
+        _users.pop(user_id)
+
+on_users_changed(_user_changed)
+
+
+def _authenticate(token):
+    """
+    Get the user a token belongs to, from the caches if possible.
+    
+    Returns:
+        (user_id, user): user_id is None if the token is invalid or
+        expired, and user is None if there is no such user
+    """
+    now = time.time()
+    
+    # Verify the token (JWT decoding checks the signature and expiry)
+    user_id = _tokens.get(token)
+    if user_id is None:
+        decoded = _decode_token(token)
+        if not decoded or not decoded.get('user_id'):
+            return None, None
+        user_id = decoded['user_id']
+        _tokens.put(token, user_id, min(now + Config.AUTH_CACHE_TTL, decoded.get('exp', now)))
+    
+    # Get the user from the database. Changes other processes made only
+    # reach _user_changed once they are read, so read them first - it's
+    # one stat() when there are none
+    catch_up('users')
+    user = _users.get(user_id)
+    if user is None:
+        version = _users_version
+        user = get_user_by_id(user_id)
+        if user and version == _users_version:
+            _users.put(user_id, user, now + Config.AUTH_CACHE_TTL)
+    return user_id, user
+
+
 def require_auth(f):
     """
     Decorator function that requires authentication.
     Use this on any route that needs the user to be logged in.
     Works with JSON database.
+    
+    Verified tokens and their users are cached (see _authenticate), so
+    most requests don't decode the token or read the database.
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -110,20 +221,12 @@ def require_auth(f):
         except:
             return jsonify({'error': 'Invalid authorization header'}), 401
         
-        # Verify the token and get user ID
-        user_id = verify_token(token)
+        # Verify the token and get the user it belongs to
+        user_id, user = _authenticate(token)
         
         if not user_id:
             return jsonify({'error': 'Invalid or expired token'}), 401
         
-        # Get the user from JSON database
-        import sys
-        import os
-        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        from json_db import get_user_by_id
-        
-        user = get_user_by_id(user_id)
-        
         if not user:
             return jsonify({'error': 'User not found'}), 401
         
@@ -0,0 +1,120 @@
+"""
+Benchmark the approximate (LSH) matcher against the exact one.
+
+Builds a made-up population in memory (the database isn't touched), then
+for a sample of users compares the exact best candidates with the ones
+the LSH index finds. Prints recall (how often LSH finds the best score,
+and how many places of the exact top N it fills with an equally good
+candidate) and the time per lookup of both.
+
+Usage:
+    python benchmark_matcher.py
+    python benchmark_matcher.py --users 1000000 --bands 20 --rows 3
+"""
+
+import argparse
+import random
+import time
+from app.lsh import MinHashIndex
+from app.matching import rank_key, score_sets
+from config import Config
+
+
+def make_users(count, vocabulary, min_interests, max_interests, seed):
+    """Give each user a few interests, with some interests much more popular"""
+    rng = random.Random(seed)
+    names = ['interest-%d' % i for i in range(vocabulary)]
+    # Zipf-like popularity: interest i is picked with weight 1 / (i + 1)
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    users = {}
+    for user_id in range(1, count + 1):
+        size = rng.randint(min_interests, max_interests)
+        users[user_id] = list(set(rng.choices(names, weights, k=size)))
+    return users
+
+
+def build_exact(users):
+    """The exact matcher's structures: interest -> user IDs, and sets of interest IDs"""
+    interest_ids = {}
+    id_sets = {}
+    postings = {}
+    for user_id, interests in users.items():
+        id_sets[user_id] = frozenset(interest_ids.setdefault(name, len(interest_ids)) for name in interests)
+        for name in interests:
+            postings.setdefault(name, []).append(user_id)
+    return postings, id_sets
+
+
+def exact_top(user_id, users, postings, id_sets, k):
+    """Score everyone who shares an interest, like rank_candidates"""
+    candidates = set()
+    for name in users[user_id]:
+        candidates.update(postings[name])
+    candidates.discard(user_id)
+    return _top(user_id, candidates, id_sets, k)
+
+
+def _top(user_id, candidates, id_sets, k):
+    mine = id_sets[user_id]
+    scored = [(score_sets(mine, id_sets[other_id]), other_id) for other_id in candidates]
+    return sorted([item for item in scored if item[0] > 0], key=rank_key)[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000, help='size of the made-up population')
+    parser.add_argument('--vocabulary', type=int, default=500, help='number of different interests')
+    parser.add_argument('--min-interests', type=int, default=3)
+    parser.add_argument('--max-interests', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=200, help='users to look up')
+    parser.add_argument('--top', type=int, default=10, help='recall is measured over the top N')
+    parser.add_argument('--bands', type=int, default=Config.LSH_BANDS)
+    parser.add_argument('--rows', type=int, default=Config.LSH_ROWS)
+    parser.add_argument('--max-candidates', type=int, default=Config.LSH_MAX_CANDIDATES)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print('Making %d users...' % args.users)
+    users = make_users(args.users, args.vocabulary, args.min_interests, args.max_interests, args.seed)
+    postings, id_sets = build_exact(users)
+
+    start = time.perf_counter()
+    index = MinHashIndex(args.bands, args.rows, args.max_candidates)
+    index.build(users)
+    print('LSH index (%d bands x %d rows) built in %.1fs' % (args.bands, args.rows, time.perf_counter() - start))
+
+    sample = random.Random(args.seed).sample(list(users), min(args.queries, len(users)))
+    exact_time = lsh_time = 0
+    best_found = top_found = top_total = candidates_total = with_matches = 0
+    for user_id in sample:
+        start = time.perf_counter()
+        exact = exact_top(user_id, users, postings, id_sets, args.top)
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        candidates = index.lookup(user_id)
+        approximate = _top(user_id, candidates, id_sets, args.top)
+        lsh_time += time.perf_counter() - start
+
+        candidates_total += len(candidates)
+        if not exact:
+            continue
+        with_matches += 1
+        # Recall is measured by score: many people can tie, so LSH finding
+        # someone else with the same score is just as good
+        if approximate and approximate[0][0] == exact[0][0]:
+            best_found += 1
+        top_found += sum(1 for mine, theirs in zip(approximate, exact) if mine[0] >= theirs[0])
+        top_total += len(exact)
+
+    queries = len(sample)
+    print()
+    print('%-28s %10s %10s' % ('', 'exact', 'lsh'))
+    print('%-28s %10.2f %10.2f' % ('ms per lookup', exact_time * 1000 / queries, lsh_time * 1000 / queries))
+    print('%-28s %10s %10.0f' % ('candidates scored (average)', '', candidates_total / queries))
+    print('%-28s %10s %9.1f%%' % ('best score found', '', 100 * best_found / max(with_matches, 1)))
+    print('%-28s %10s %9.1f%%' % ('recall of top %d' % args.top, '', 100 * top_found / max(top_total, 1)))
+
+
+if __name__ == '__main__':
+    main()
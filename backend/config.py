@@ -15,6 +15,9 @@ from dotenv import load_dotenv
 # This lets you set SECRET_KEY in a .env file instead of hardcoding it
 load_dotenv()
 
+# Folder this file lives in (the backend folder)
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     """
     Configuration class that holds all app settings.
@@ -30,4 +33,78 @@ class Config:
     # - When user makes requests, we verify the token using this key
     # - If someone changes the token, verification will fail
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-
+    
+    # require_auth remembers tokens it has verified and the users they
+    # belong to (see app/utils.py)
+    # - how many tokens and users to keep (least recently used go first)
+    # - how many seconds an entry lives. Changes to a user made by this
+    #   process are seen at once; this bounds how long changes made by
+    #   another worker process can go unnoticed
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE') or 10000)
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL') or 60)
+    
+    # Password hashing (see passwords.py)
+    # - bcrypt cost: each step up doubles the time a hash takes. Passwords
+    #   hashed with another cost are rehashed the next time the user logs in
+    # - how many hashes can run at once, on threads of their own
+    # - how many more can wait for one; past that, signup and login answer
+    #   503 so the server isn't buried under a burst
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS') or 12)
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS') or 2)
+    PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT') or 16)
+    
+    # Folder where the JSON database keeps its files - one snapshot and one
+    # journal per collection (users.json, users.journal, matches.json, ...)
+    # The first time the app runs, database.json is imported into this folder
+    DATA_DIR = os.environ.get('DATA_DIR') or os.path.join(BASE_DIR, 'data')
+    
+    # How many records a journal can hold before it is folded into a fresh
+    # snapshot of its table in the background (compaction)
+    JSON_COMPACT_AFTER = int(os.environ.get('JSON_COMPACT_AFTER') or 1000)
+    
+    # Which database to use:
+    # - 'json': JSON files in DATA_DIR, kept in memory (json_db.py)
+    # - 'sqlite': a SQLite database file at SQLITE_PATH (sqlite_db.py)
+    DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND') or 'json'
+    SQLITE_PATH = os.environ.get('SQLITE_PATH') or os.path.join(BASE_DIR, 'tameet.db')
+    
+    # How many idle SQLite connections to keep around for reuse
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE') or 8)
+    
+    # Match recommendations cache (see app/matching.py)
+    # - how many users' ranked candidate lists to keep (least recently used go first)
+    # - how many top candidates to keep per user
+    # - how many seconds an entry lives, as a backstop for changes we aren't
+    #   told about (e.g. another worker process changing interests in SQLite)
+    RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE') or 10000)
+    RECOMMENDATION_TOP_K = int(os.environ.get('RECOMMENDATION_TOP_K') or 50)
+    RECOMMENDATION_CACHE_TTL = int(os.environ.get('RECOMMENDATION_CACHE_TTL') or 300)
+    
+    # Declined people are kept out of /find and the feed
+    # - how many declines to remember per user (the oldest are forgotten first)
+    # - after how many days a decline is forgotten (0 = only when pushed out)
+    DECLINE_MEMORY_SIZE = int(os.environ.get('DECLINE_MEMORY_SIZE') or 500)
+    DECLINE_EXPIRY_DAYS = int(os.environ.get('DECLINE_EXPIRY_DAYS') or 30)
+    
+    # "People you may know" cache (see app/suggestions.py)
+    # - how many users' suggestion lists to keep (least recently used go first)
+    # - how many suggestions to keep per user
+    # - how many seconds an entry lives (another worker process's follows
+    #   in SQLite aren't reported to us)
+    SUGGESTION_CACHE_SIZE = int(os.environ.get('SUGGESTION_CACHE_SIZE') or 10000)
+    SUGGESTION_TOP_K = int(os.environ.get('SUGGESTION_TOP_K') or 50)
+    SUGGESTION_CACHE_TTL = int(os.environ.get('SUGGESTION_CACHE_TTL') or 300)
+    
+    # How /find and the feed look for candidates (see app/matching.py):
+    # - 'exact': everyone who shares at least one interest with you
+    # - 'lsh': only people in the same MinHash/LSH buckets as you (app/lsh.py).
+    #   Much faster with very many users, but can miss some good matches -
+    #   run benchmark_matcher.py to see how many for a given setting
+    MATCHER = os.environ.get('MATCHER') or 'exact'
+    
+    # LSH settings: more bands finds more matches (higher recall) but
+    # gives more candidates to score; more rows per band does the opposite.
+    # At most LSH_MAX_CANDIDATES people are scored per request
+    LSH_BANDS = int(os.environ.get('LSH_BANDS') or 16)
+    LSH_ROWS = int(os.environ.get('LSH_ROWS') or 2)
+    LSH_MAX_CANDIDATES = int(os.environ.get('LSH_MAX_CANDIDATES') or 5000)
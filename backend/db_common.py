@@ -0,0 +1,93 @@
+"""
+Helpers shared by the two database backends, json_db.py and sqlite_db.py:
+interest names, user search, decline expiry and checking logins.
+"""
+
+from datetime import datetime, timedelta
+from config import Config
+from passwords import hash_password, check_password, needs_rehash, PasswordQueueFull
+
+
+def interest_key(name):
+    """Normalize an interest name for comparing: 'Board  Games ' == 'board games'"""
+    return ' '.join(name.split()).casefold()
+
+
+# User search
+
+# Users are indexed by every piece of this many letters of their name and
+# email, so a query only reads the users who have all of its pieces.
+# Shorter queries are looked up by prefix instead (see search_words).
+SEARCH_GRAM = 3
+
+def search_texts(user):
+    """The lowercase texts a user can be found by: name and email"""
+    return [(user.get('name') or '').lower(), (user.get('email') or '').lower()]
+
+def search_grams(user):
+    """Get every piece of SEARCH_GRAM letters of a user's name and email"""
+    grams = set()
+    for text in search_texts(user):
+        for start in range(len(text) - SEARCH_GRAM + 1):
+            grams.add(text[start:start + SEARCH_GRAM])
+    return sorted(grams)
+
+def search_words(user):
+    """
+    Get the texts a query shorter than SEARCH_GRAM is matched against by
+    prefix: the name, the rest of the name after each space, and the email
+    """
+    name, email = search_texts(user)
+    rests = [name[start + 1:] for start in range(len(name)) if name[start] == ' ']
+    return sorted({name, email, *rests} - {''})
+
+def query_grams(query):
+    """Get the pieces every user matching a (lowercase) query has - at least SEARCH_GRAM letters long"""
+    return sorted({query[start:start + SEARCH_GRAM] for start in range(len(query) - SEARCH_GRAM + 1)})
+
+def search_tier(user, query):
+    """
+    How well a user matches a (lowercase) query: 0 if their name or email
+    starts with it, 1 if a word of their name does, 2 for other matches.
+    None if they don't match. Everyone matches an empty query with 0.
+    """
+    name, email = search_texts(user)
+    if name.startswith(query) or email.startswith(query):
+        return 0
+    if ' ' + query in name:
+        return 1
+    if query in name or query in email:
+        return 2
+    return None
+
+def search_key(tier, user, query):
+    """Search results are sorted by tier, then name - or only by ID for an empty query"""
+    if not query:
+        return (tier, user['id'])
+    return (tier, search_texts(user)[0], user['id'])
+
+
+def decline_cutoff():
+    """Declines older than this have expired (None if they never do)"""
+    if not Config.DECLINE_EXPIRY_DAYS:
+        return None
+    return (datetime.utcnow() - timedelta(days=Config.DECLINE_EXPIRY_DAYS)).isoformat()
+
+
+def check_login(user, password, update_user):
+    """
+    Check a password against a user (None if no user has the email given).
+    Returns the user if it matches, else None. A hash made with another
+    cost than BCRYPT_ROUNDS is replaced through update_user while we have
+    the password.
+    """
+    if not user or not check_password(password, user['password_hash']):
+        return None
+    if needs_rehash(user['password_hash']):
+        try:
+            password_hash = hash_password(password)
+        except PasswordQueueFull:
+            # The password was right - replace the hash at the next login
+            return user
+        user = update_user(user['id'], password_hash=password_hash) or user
+    return user
@@ -1,282 +1,731 @@
 """
-JSON database - stores all data in a JSON file.
+JSON database - stores all data in JSON files, one per collection.
+Changes are written to a small journal file first and folded back into
+the collection's file from time to time (see json_store.py).
 """
 
-import json
 import os
-import bcrypt
+import heapq
+import threading
+from array import array
 from datetime import datetime
-
-def hash_password(password):
-    """Hash a password using bcrypt"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-def check_password(password, password_hash):
-    """Check if password matches hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+from json_store import JsonStore, Table, Index, SortedIndex
+from config import Config
+from passwords import hash_password, check_password
+from db_common import (
+    interest_key, SEARCH_GRAM, search_grams, search_words, query_grams, search_tier, search_key,
+    decline_cutoff, check_login
+)
 
 # Get absolute path to database.json (in backend directory)
+# It holds the seed data and is imported into Config.DATA_DIR on first run
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(BASE_DIR, 'database.json')
 
-def load_db():
-    """Load database from JSON file"""
-    if not os.path.exists(DB_FILE):
-        # Initialize empty database
-        return {
-            "users": [],
-            "interests": [],
-            "matches": [],
-            "follows": [],
-            "notes": []
+
+class UserTable(Table):
+    """
+    Users, looked up by email or for find_users: by the pieces of
+    SEARCH_GRAM letters of their name and email ('search'), or by prefix
+    ('prefix', see search_words). Every change is reported to the
+    on_users_changed callbacks, whether it was made here or read from the
+    journal.
+    """
+
+    def __init__(self):
+        super().__init__('users', indexes=[
+            Index('email', lambda u: [u['email']], unique=True),
+            Index('search', search_grams),
+            SortedIndex('prefix', search_words)
+        ])
+
+    def reindex(self):
+        super().reindex()
+        _users_changed(None)
+
+    def set(self, row):
+        super().set(row)
+        _users_changed(row['id'])
+
+    def remove(self, pk):
+        super().remove(pk)
+        _users_changed(pk)
+
+
+class InterestTable(Table):
+    """
+    Interests are kept as one row per user, with the names interned:
+    every different interest (ignoring case and extra spaces) gets an
+    integer ID, and a row only holds the user's IDs in order:
+    {'user_id': 1, 'ids': array('I', [...])}. The first spelling seen is
+    the one shown. The snapshot and the journal still use names (the
+    snapshot in the old one-record-per-interest format), so the IDs are
+    only meaningful inside this process.
+
+    Each user's interest IDs are also kept as a frozenset, so comparing two
+    users costs as much as the smaller of their interest lists - however
+    many different interests everyone together has named.
+
+    The 'interest' index lists the users who have each interest ID.
+
+    Every change is reported to the on_interests_changed callbacks, whether
+    it was made here or read from the journal of another process.
+    """
+
+    def __init__(self):
+        super().__init__('interests', key='user_id', indexes=[
+            Index('interest', lambda row: row['ids'])
+        ])
+        self.names = []
+        self.ids = {}
+        self.id_sets = {}
+
+    def intern(self, name):
+        """Get the ID of an interest name, numbering new ones (None if blank)"""
+        key = interest_key(name)
+        if not key:
+            return None
+        interest_id = self.ids.get(key)
+        if interest_id is None:
+            interest_id = self.ids[key] = len(self.names)
+            self.names.append(' '.join(name.split()))
+        return interest_id
+
+    def interned(self, row):
+        """Turn a row with a list of names into one with IDs"""
+        if 'ids' in row:
+            return row
+        ids = array('I')
+        for name in row['interests']:
+            interest_id = self.intern(name)
+            if interest_id is not None and interest_id not in ids:
+                ids.append(interest_id)
+        return {'user_id': row['user_id'], 'ids': ids}
+
+    def interest_names(self, row):
+        """Get the names of the interests in a row"""
+        return [self.names[interest_id] for interest_id in row['ids']]
+
+    def reindex(self):
+        super().reindex()
+        self.id_sets = {pk: frozenset(row['ids']) for pk, row in self.rows.items()}
+        _interests_changed(None)
+
+    def set(self, row):
+        row = self.interned(row)
+        super().set(row)
+        self.id_sets[row['user_id']] = frozenset(row['ids'])
+        _interests_changed(row['user_id'])
+
+    def remove(self, pk):
+        super().remove(pk)
+        self.id_sets.pop(pk, None)
+        _interests_changed(pk)
+
+    def load_records(self, records):
+        names = {}
+        for record in records:
+            names.setdefault(record['user_id'], []).append(record['interest_name'])
+        self.rows = {
+            user_id: self.interned({'user_id': user_id, 'interests': interests})
+            for user_id, interests in names.items()
         }
-    
-    with open(DB_FILE, 'r') as f:
-        return json.load(f)
+        self.reindex()
+
+    def dump_records(self):
+        return [
+            {'user_id': row['user_id'], 'interest_name': name}
+            for row in self.rows.values()
+            for name in self.interest_names(row)
+        ]
+
+
+class DeclineTable(Table):
+    """
+    The people each user declined, kept as one row per user:
+    {'user_id': 1, 'declined': [[user_id, declined_at], ...]} sorted by
+    user ID. The snapshot has one record per declined pair.
+    """
+
+    def __init__(self):
+        super().__init__('declines', key='user_id')
+
+    def load_records(self, records):
+        self.rows = {}
+        for record in records:
+            row = self.rows.setdefault(record['user_id'], {'user_id': record['user_id'], 'declined': []})
+            row['declined'].append([record['declined_id'], record['declined_at']])
+        for row in self.rows.values():
+            row['declined'].sort()
+        self.reindex()
+
+    def dump_records(self):
+        return [
+            {'user_id': row['user_id'], 'declined_id': declined_id, 'declined_at': declined_at}
+            for row in self.rows.values()
+            for declined_id, declined_at in row['declined']
+        ]
+
+
+class FollowTable(Table):
+    """
+    Follow records, plus the follow graph as adjacency sets:
+    following[user_id] is the set of people they follow, and
+    followers[user_id] the set of people who follow them. Checking a
+    follow or counting either side is then a set lookup or len().
+
+    The 'pair' index finds the record of one follow.
+
+    Every change is reported to the on_follows_changed callbacks with the
+    ID of the follower, whether it was made here or read from the journal.
+    """
+
+    def __init__(self):
+        super().__init__('follows', indexes=[
+            Index('pair', lambda f: [(f['follower_id'], f['followed_id'])], unique=True)
+        ])
+        self.following = {}
+        self.followers = {}
+
+    def reindex(self):
+        super().reindex()
+        self.following = {}
+        self.followers = {}
+        for row in self.rows.values():
+            self._link(row)
+        _follows_changed(None)
+
+    def set(self, row):
+        old_row = self.rows.get(row['id'])
+        if old_row is not None:
+            self._unlink(old_row)
+        super().set(row)
+        self._link(row)
+        _follows_changed(row['follower_id'])
+
+    def remove(self, pk):
+        row = self.rows.get(pk)
+        super().remove(pk)
+        if row is not None:
+            self._unlink(row)
+            _follows_changed(row['follower_id'])
+
+    def _link(self, row):
+        self.following.setdefault(row['follower_id'], set()).add(row['followed_id'])
+        self.followers.setdefault(row['followed_id'], set()).add(row['follower_id'])
+
+    def _unlink(self, row):
+        self._discard(self.following, row['follower_id'], row['followed_id'])
+        self._discard(self.followers, row['followed_id'], row['follower_id'])
+
+    @staticmethod
+    def _discard(sets, user_id, other_id):
+        others = sets.get(user_id)
+        if others is not None:
+            others.discard(other_id)
+            # Don't keep empty sets around for everyone who ever unfollowed
+            if not others:
+                del sets[user_id]
+
+
+# Functions called with a user ID when that user's record changes
+_user_listeners = []
+
+def on_users_changed(callback):
+    """
+    Call callback(user_id) whenever a user is added or changed. It gets
+    None when the whole table was reloaded. Like on_interests_changed, it
+    runs while the database is locked, so it should only take note.
+    """
+    _user_listeners.append(callback)
+
+def _users_changed(user_id):
+    for callback in _user_listeners:
+        callback(user_id)
+
+
+# Functions called with a user ID when that user's interests change
+_interest_listeners = []
+
+def on_interests_changed(callback):
+    """
+    Call callback(user_id) whenever someone's interests change. It gets None
+    when the whole table was reloaded. It runs while the database is locked,
+    so it should only take note of the change, not read or write.
+    """
+    _interest_listeners.append(callback)
+
+def _interests_changed(user_id):
+    for callback in _interest_listeners:
+        callback(user_id)
+
+
+# Functions called with a user ID when the people that user follows change
+_follow_listeners = []
+
+def on_follows_changed(callback):
+    """
+    Call callback(user_id) whenever someone follows or unfollows a user,
+    with the ID of the one who did. It gets None when the whole table was
+    reloaded. Like on_interests_changed, it runs while the database is
+    locked, so it should only take note of the change.
+    """
+    _follow_listeners.append(callback)
+
+def _follows_changed(user_id):
+    for callback in _follow_listeners:
+        callback(user_id)
 
-def save_db(data):
-    """Save database to JSON file"""
-    with open(DB_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
 
-def get_next_id(items):
-    """Get next ID for a list of items"""
-    if not items:
-        return 1
-    return max(item.get('id', 0) for item in items) + 1
+# The whole database lives in memory once it has been read from disk
+_store = None
+_store_lock = threading.Lock()
+
+def _get_store():
+    """Get the storage engine, loading the database on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = JsonStore(Config.DATA_DIR, [
+                    UserTable(),
+                    InterestTable(),
+                    Table('matches', indexes=[
+                        Index('user', lambda m: [m['user1_id'], m['user2_id']]),
+                        Index('pair', lambda m: [_pair(m['user1_id'], m['user2_id'])], unique=True)
+                    ]),
+                    FollowTable(),
+                    Table('notes', indexes=[
+                        Index('match_user', lambda n: [(n['match_id'], n['user_id'])], unique=True)
+                    ]),
+                    DeclineTable()
+                ], compact_after=Config.JSON_COMPACT_AFTER)
+                store.load(import_file=DB_FILE)
+                _store = store
+    return _store
+
+def _read(*tables):
+    """Hold a consistent view of some tables while reading them"""
+    return _get_store().read(*tables)
+
+def _rows(table):
+    """Get the rows of a table keyed by primary key (use inside _read)"""
+    return _get_store().tables[table].rows
+
+def _index(table, name):
+    """Get one of the secondary indexes of a table (use inside _read)"""
+    return _get_store().tables[table].indexes[name]
+
+def _pair(user1_id, user2_id):
+    """Key for a match between two users, whichever order they are given in"""
+    return (min(user1_id, user2_id), max(user1_id, user2_id))
+
+def read_view():
+    """
+    Run several reads against one consistent view of the database.
+    Other threads can't change the data until the block ends, so it must
+    only contain reads - writing inside it raises RuntimeError.
+    """
+    return _get_store().read()
+
+def transaction():
+    """
+    Make several changes as one unit: other requests see all of them or
+    none, and if the block raises they are all undone. Reads inside the
+    block see the changes made so far.
+    """
+    return _get_store().transaction()
+
+def catch_up(*tables):
+    """
+    Read the changes other processes made to some tables (all of them if
+    none are named), so they reach the on_..._changed callbacks. Costs a
+    stat() per table when nothing changed.
+    """
+    store = _get_store()
+    for table in tables or store.tables:
+        store.refresh(table)
+
+def load_db():
+    """Get a copy of the whole database as a dict of lists"""
+    return _get_store().export()
+
+def save_db(data):
+    """Replace the whole database and write fresh collection files"""
+    _get_store().replace(data)
 
 # User functions
 def get_user_by_email(email):
     """Get user by email"""
-    db = load_db()
-    for user in db['users']:
-        if user['email'] == email:
-            return user
-    return None
+    with _read('users'):
+        return _index('users', 'email').get(email)
 
 def get_user_by_id(user_id):
     """Get user by ID"""
-    db = load_db()
-    for user in db['users']:
-        if user['id'] == user_id:
-            return user
-    return None
+    with _read('users'):
+        return _rows('users').get(user_id)
+
+def get_users_by_ids(user_ids):
+    """Get several users at once, as user_id -> user (IDs with no user are left out)"""
+    with _read('users'):
+        rows = _rows('users')
+        users = {user_id: rows.get(user_id) for user_id in user_ids}
+    return {user_id: user for user_id, user in users.items() if user}
 
 def create_user(email, password, name, bio='', profile_picture=None):
     """Create a new user"""
-    db = load_db()
-    
-    # Check if user already exists
-    if get_user_by_email(email):
-        return None
+    # Hash before taking the write lock - bcrypt is slow on purpose
+    password_hash = hash_password(password)
     
-    # Create user
-    new_user = {
-        'id': get_next_id(db['users']),
-        'email': email,
-        'password_hash': hash_password(password),
-        'name': name,
-        'bio': bio,
-        'profile_picture': profile_picture,
-        'created_at': datetime.utcnow().isoformat()
-    }
-    
-    db['users'].append(new_user)
-    save_db(db)
-    
-    # Automatically create match with Maddie
-    maddie = get_user_by_email('maddie.cush@northeastern.edu')
-    if maddie and maddie['id'] != new_user['id']:
-        create_match(new_user['id'], maddie['id'], 95)
+    with transaction():
+        # Check if user already exists
+        if get_user_by_email(email):
+            return None
+        
+        # Create user
+        new_user = _get_store().insert('users', {
+            'email': email,
+            'password_hash': password_hash,
+            'name': name,
+            'bio': bio,
+            'profile_picture': profile_picture,
+            'created_at': datetime.utcnow().isoformat()
+        })
+        
+        # Automatically create match with Maddie
+        maddie = get_user_by_email('maddie.cush@northeastern.edu')
+        if maddie and maddie['id'] != new_user['id']:
+            create_match(new_user['id'], maddie['id'], 95)
     
     return new_user
 
 def verify_user(email, password):
     """Verify user login"""
-    user = get_user_by_email(email)
-    if not user:
-        return None
-    
-    if check_password(password, user['password_hash']):
-        return user
-    return None
+    return check_login(get_user_by_email(email), password, update_user)
 
 def update_user(user_id, **kwargs):
     """Update user fields"""
-    db = load_db()
-    for user in db['users']:
-        if user['id'] == user_id:
-            for key, value in kwargs.items():
-                if key != 'id' and key != 'email':
-                    user[key] = value
-            save_db(db)
-            return user
-    return None
+    with transaction():
+        user = get_user_by_id(user_id)
+        if not user:
+            return None
+        
+        user = dict(user)
+        for key, value in kwargs.items():
+            if key != 'id' and key != 'email':
+                user[key] = value
+        return _get_store().put('users', user)
 
 def get_user_interests(user_id):
     """Get interests for a user"""
-    db = load_db()
-    return [i['interest_name'] for i in db['interests'] if i['user_id'] == user_id]
+    with _read('interests'):
+        row = _rows('interests').get(user_id)
+        return _get_store().tables['interests'].interest_names(row) if row else []
+
+def get_all_user_interests():
+    """Get every user's interests as a dict from user ID to list of names"""
+    with _read('interests'):
+        table = _get_store().tables['interests']
+        return {user_id: table.interest_names(row) for user_id, row in table.rows.items()}
+
+def get_interest_sets(user_ids):
+    """
+    Get each user's interests as a frozenset of interest IDs. Users without
+    interests get an empty set. Only compare sets from the same call.
+    """
+    with _read('interests'):
+        id_sets = _get_store().tables['interests'].id_sets
+        return {user_id: id_sets.get(user_id, frozenset()) for user_id in user_ids}
+
+def get_interest_overlap(user_id):
+    """
+    Count the interests other users share with this one.
+    Users who share none are left out.
+    """
+    with _read('interests'):
+        row = _rows('interests').get(user_id)
+        if not row:
+            return {}
+        # Walk the list of users for each of our interests
+        index = _index('interests', 'interest')
+        shared = {}
+        for interest_id in row['ids']:
+            for other_id in index.pks(interest_id):
+                shared[other_id] = shared.get(other_id, 0) + 1
+    shared.pop(user_id, None)
+    return shared
 
 def set_user_interests(user_id, interests):
-    """Set interests for a user"""
-    db = load_db()
-    # Remove old interests
-    db['interests'] = [i for i in db['interests'] if i['user_id'] != user_id]
-    # Add new interests
-    for interest_name in interests:
-        db['interests'].append({
-            'user_id': user_id,
-            'interest_name': interest_name
-        })
-    save_db(db)
+    """Set interests for a user (names differing only in case or spaces count as one)"""
+    if interests:
+        _get_store().put('interests', {'user_id': user_id, 'interests': list(interests)})
+    else:
+        _get_store().delete('interests', user_id)
 
 # Match functions
 def create_match(user1_id, user2_id, match_score=0):
     """Create a match between two users"""
-    db = load_db()
-    
-    # Check if match already exists
-    for match in db['matches']:
-        if (match['user1_id'] == user1_id and match['user2_id'] == user2_id) or \
-           (match['user1_id'] == user2_id and match['user2_id'] == user1_id):
+    with transaction():
+        # Check if match already exists
+        with _read('matches'):
+            match = _index('matches', 'pair').get(_pair(user1_id, user2_id))
+        if match:
             return match
-    
-    # Create new match
-    new_match = {
-        'id': get_next_id(db['matches']),
-        'user1_id': min(user1_id, user2_id),
-        'user2_id': max(user1_id, user2_id),
-        'user1_accepted': True,
-        'user2_accepted': True,
-        'match_score': match_score,
-        'is_active': True,
-        'created_at': datetime.utcnow().isoformat(),
-        'archived_at': None
-    }
-    
-    db['matches'].append(new_match)
-    save_db(db)
-    return new_match
+        
+        # Create new match
+        return _get_store().insert('matches', {
+            'user1_id': min(user1_id, user2_id),
+            'user2_id': max(user1_id, user2_id),
+            'user1_accepted': True,
+            'user2_accepted': True,
+            'match_score': match_score,
+            'is_active': True,
+            'created_at': datetime.utcnow().isoformat(),
+            'archived_at': None
+        })
 
 def get_user_matches(user_id, active_only=True):
     """Get all matches for a user"""
-    db = load_db()
-    matches = []
-    
-    for match in db['matches']:
-        if match['user1_id'] == user_id or match['user2_id'] == user_id:
-            if not active_only or match['is_active']:
-                matches.append(match)
-    
+    with _read('matches'):
+        matches = _index('matches', 'user').find(user_id)
+    if active_only:
+        matches = [m for m in matches if m['is_active']]
     return matches
 
 def archive_match(match_id):
     """Archive a match"""
-    db = load_db()
-    for match in db['matches']:
-        if match['id'] == match_id:
-            match['is_active'] = False
-            match['archived_at'] = datetime.utcnow().isoformat()
-            save_db(db)
-            return match
-    return None
+    with transaction():
+        with _read('matches'):
+            match = _rows('matches').get(match_id)
+        if not match:
+            return None
+        
+        match = dict(match)
+        match['is_active'] = False
+        match['archived_at'] = datetime.utcnow().isoformat()
+        return _get_store().put('matches', match)
 
 def get_all_users(except_user_id=None):
     """Get all users except specified one"""
-    db = load_db()
-    users = db['users'].copy()
+    with _read('users'):
+        users = list(_rows('users').values())
     if except_user_id:
         users = [u for u in users if u['id'] != except_user_id]
     return users
 
+def find_users(query, except_user_id=None, after=None, limit=None):
+    """
+    Find the users whose name or email contains query (ignoring case),
+    best matches first: see search_tier, and equal tiers are sorted by
+    name. An empty query finds everyone, by ID. Only the users who have
+    every piece of the query in the search index are looked at; a query
+    shorter than SEARCH_GRAM only finds the users whose name, a word of
+    their name or email starts with it.
+    
+    Args:
+        query: What to look for
+        except_user_id: A user to leave out (e.g. the one searching)
+        after: The (tier, user_id) the previous page ended with, or None
+        limit: How many users to return (None: all of them)
+    
+    Returns:
+        (page, has_more) where page is a list of (tier, user)
+    """
+    query = query.lower()
+    with _read('users'):
+        if not query:
+            # Everyone, by ID - count up from where the previous page
+            # ended, so a page only reads the users on it
+            rows = _rows('users')
+            page = []
+            for user_id in range((after[1] if after else 0) + 1, _get_store().tables['users'].last_id + 1):
+                user = rows.get(user_id)
+                if user is not None and user_id != except_user_id:
+                    page.append((0, user))
+                    if limit is not None and len(page) > limit:
+                        break
+            return page[:limit], limit is not None and len(page) > limit
+        
+        if len(query) >= SEARCH_GRAM:
+            index = _index('users', 'search')
+            grams = query_grams(query)
+            # Start from the rarest piece and check the others by primary key
+            rarest = min(grams, key=index.count)
+            others = [index.pks(gram) for gram in grams if gram != rarest]
+            candidates = [user for user in index.find(rarest) if all(user['id'] in pks for pks in others)]
+        else:
+            rows = _rows('users')
+            candidates = [rows[user_id] for user_id in _index('users', 'prefix').prefix(query)]
+        
+        # Where the previous page ended
+        after_key = None
+        if after:
+            tier, user_id = after
+            after_key = search_key(tier, _rows('users').get(user_id) or {'id': user_id, 'name': ''}, query)
+    
+    found = []
+    for user in candidates:
+        if user['id'] == except_user_id:
+            continue
+        # The pieces can all be there without the whole query being there
+        tier = search_tier(user, query)
+        if tier is None:
+            continue
+        key = search_key(tier, user, query)
+        if after_key is None or key > after_key:
+            found.append((key, tier, user))
+    
+    # Only the page itself has to be put in order
+    if limit is None:
+        found.sort(key=lambda item: item[0])
+    else:
+        found = heapq.nsmallest(limit + 1, found, key=lambda item: item[0])
+    page = [(tier, user) for key, tier, user in found[:limit]]
+    return page, limit is not None and len(found) > limit
+
+# Decline functions
+def decline_user(user_id, declined_id):
+    """Remember that a user declined someone (IDs that aren't numbers raise ValueError)"""
+    # Every ID in the list has to be an int, or sorting it fails
+    user_id, declined_id = int(user_id), int(declined_id)
+    with transaction():
+        with _read('declines'):
+            row = _rows('declines').get(user_id)
+        declined = [list(pair) for pair in row['declined']] if row else []
+        
+        # Drop expired declines and the old entry for this person
+        cutoff = decline_cutoff()
+        declined = [pair for pair in declined
+                    if pair[0] != declined_id and (cutoff is None or pair[1] >= cutoff)]
+        declined.append([declined_id, datetime.utcnow().isoformat()])
+        
+        # Only keep the most recent ones
+        if len(declined) > Config.DECLINE_MEMORY_SIZE:
+            declined.sort(key=lambda pair: pair[1])
+            declined = declined[-Config.DECLINE_MEMORY_SIZE:]
+        declined.sort()
+        _get_store().put('declines', {'user_id': user_id, 'declined': declined})
+
+def get_declined_user_ids(user_id):
+    """Get the IDs of the people a user declined (and who haven't expired)"""
+    with _read('declines'):
+        row = _rows('declines').get(user_id)
+    if not row:
+        return set()
+    cutoff = decline_cutoff()
+    return {declined_id for declined_id, declined_at in row['declined']
+            if cutoff is None or declined_at >= cutoff}
+
 # Follow functions
+def _find_follow(follower_id, followed_id):
+    """Get the follow record between two users, if any"""
+    with _read('follows'):
+        return _index('follows', 'pair').get((follower_id, followed_id))
+
 def follow_user(follower_id, followed_id):
     """Create follow relationship"""
-    db = load_db()
-    
-    # Check if already following
-    for follow in db['follows']:
-        if follow['follower_id'] == follower_id and follow['followed_id'] == followed_id:
+    with transaction():
+        # Check if already following
+        follow = _find_follow(follower_id, followed_id)
+        if follow:
             return follow
-    
-    new_follow = {
-        'id': get_next_id(db['follows']),
-        'follower_id': follower_id,
-        'followed_id': followed_id,
-        'created_at': datetime.utcnow().isoformat()
-    }
-    
-    db['follows'].append(new_follow)
-    save_db(db)
-    return new_follow
+        
+        return _get_store().insert('follows', {
+            'follower_id': follower_id,
+            'followed_id': followed_id,
+            'created_at': datetime.utcnow().isoformat()
+        })
 
 def unfollow_user(follower_id, followed_id):
     """Remove follow relationship"""
-    db = load_db()
-    db['follows'] = [f for f in db['follows'] 
-                     if not (f['follower_id'] == follower_id and f['followed_id'] == followed_id)]
-    save_db(db)
+    with transaction():
+        follow = _find_follow(follower_id, followed_id)
+        if follow:
+            _get_store().delete('follows', follow['id'])
+
+def _follows():
+    """Get the follows table, with its adjacency sets (use inside _read)"""
+    return _get_store().tables['follows']
 
 def is_following(follower_id, followed_id):
     """Check if user is following another"""
-    db = load_db()
-    for follow in db['follows']:
-        if follow['follower_id'] == follower_id and follow['followed_id'] == followed_id:
-            return True
-    return False
+    with _read('follows'):
+        return followed_id in _follows().following.get(follower_id, ())
 
 def get_follower_count(user_id):
     """Get number of followers"""
-    db = load_db()
-    return len([f for f in db['follows'] if f['followed_id'] == user_id])
+    with _read('follows'):
+        return len(_follows().followers.get(user_id, ()))
 
 def get_following_count(user_id):
     """Get number of users following"""
-    db = load_db()
-    return len([f for f in db['follows'] if f['follower_id'] == user_id])
+    with _read('follows'):
+        return len(_follows().following.get(user_id, ()))
+
+def get_follow_stats(viewer_id, user_ids):
+    """
+    Get the follow numbers of several users at once, as user_id ->
+    {'is_following': viewer follows them, 'followers': n, 'following': n}
+    """
+    with _read('follows'):
+        follows = _follows()
+        viewer_following = follows.following.get(viewer_id, ())
+        return {
+            user_id: {
+                'is_following': user_id in viewer_following,
+                'followers': len(follows.followers.get(user_id, ())),
+                'following': len(follows.following.get(user_id, ()))
+            }
+            for user_id in user_ids
+        }
+
+def get_following_ids(user_ids):
+    """Get the IDs of the people each of several users follows, as user_id -> set"""
+    with _read('follows'):
+        following = _follows().following
+        return {user_id: set(following.get(user_id, ())) for user_id in user_ids}
 
 # Notes functions
 def get_match_note(match_id, user_id):
     """Get note for a match"""
-    db = load_db()
-    for note in db['notes']:
-        if note['match_id'] == match_id and note['user_id'] == user_id:
-            return note
-    return None
+    with _read('notes'):
+        return _index('notes', 'match_user').get((match_id, user_id))
+
+def get_match_notes(match_ids, user_id):
+    """Get a user's notes for several matches at once, as match_id -> note (matches without one are left out)"""
+    with _read('notes'):
+        index = _index('notes', 'match_user')
+        notes = {match_id: index.get((match_id, user_id)) for match_id in match_ids}
+    return {match_id: note for match_id, note in notes.items() if note}
 
 def save_match_note(match_id, user_id, note_text):
     """Save or update note for a match"""
-    db = load_db()
-    
-    # Find existing note
-    for note in db['notes']:
-        if note['match_id'] == match_id and note['user_id'] == user_id:
+    with transaction():
+        # Find existing note
+        note = get_match_note(match_id, user_id)
+        if note:
+            note = dict(note)
             note['note_text'] = note_text
             note['updated_at'] = datetime.utcnow().isoformat()
-            save_db(db)
-            return note
-    
-    # Create new note
-    new_note = {
-        'id': get_next_id(db['notes']),
-        'match_id': match_id,
-        'user_id': user_id,
-        'note_text': note_text,
-        'created_at': datetime.utcnow().isoformat(),
-        'updated_at': datetime.utcnow().isoformat()
-    }
-    
-    db['notes'].append(new_note)
-    save_db(db)
-    return new_note
+            return _get_store().put('notes', note)
+        
+        # Create new note
+        return _get_store().insert('notes', {
+            'match_id': match_id,
+            'user_id': user_id,
+            'note_text': note_text,
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat()
+        })
 
 def delete_match_note(match_id, user_id):
     """Delete note for a match"""
-    db = load_db()
-    db['notes'] = [n for n in db['notes'] 
-                   if not (n['match_id'] == match_id and n['user_id'] == user_id)]
-    save_db(db)
+    with transaction():
+        note = get_match_note(match_id, user_id)
+        if note:
+            _get_store().delete('notes', note['id'])
 
+# When the SQLite backend is configured, replace every function above with
+# its SQLite version so the routes keep importing from json_db
+if Config.DATABASE_BACKEND == 'sqlite':
+    from sqlite_db import *
@@ -0,0 +1,918 @@
+"""
+Storage engine behind json_db.py.
+
+All data is kept in memory as tables of rows keyed by their primary key.
+Each table has its own files in the data folder: a snapshot (users.json)
+and an append-only journal (users.journal). Every change is appended as
+one small JSON line to the journal of its table, so a write costs the size
+of the change - not the size of the table, and never touches other tables.
+On startup each snapshot is read and its journal replayed on top of it.
+
+Once a journal gets long, a background thread folds it into a fresh
+snapshot of that table (compaction). Journal records are full-row "put" or
+"delete" operations, so replaying one twice gives the same result - this
+is what makes a crash in the middle of a write or a compaction safe.
+Each journal starts with a header naming it (its generation) and where
+in the previous journal it carries on from.
+
+Several processes can share one data folder. Writers hold an exclusive
+lock on data/.lock (flock) and first catch up with whatever the other
+processes appended. Readers keep their warm in-memory copy and only look
+at the files again when the journal or snapshot has changed on disk -
+new journal lines are replayed. A compaction changes no data, so a
+process that has read the old journal (kept as users.journal.previous
+until the next compaction) finishes reading it and moves on to the new
+one; only a process more than a compaction behind reloads the snapshot.
+
+Changes can be grouped with transaction(): they are committed with one
+journal line per table and become visible together once that is done. A transaction touching several tables first writes all of its
+records to data/transaction.journal, so that if we crash halfway through
+the commit, the next writer finishes it before doing anything else.
+
+Inside one process, any number of threads can read at the same time.
+A writer makes its change durable in the journal first and only then
+takes the memory lock exclusively, for the few microseconds it takes to
+apply the change - so readers never wait for disk writes and never see a
+half-applied change. Readers don't wait for this process's own writes
+to reach the disk either: the table in memory is current until they are
+applied. When another process has written, a read waits until it has
+caught up, so a write acknowledged by any process is never missed.
+read() gives a consistent view across several reads.
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows - no locking between processes, only between threads
+    fcntl = None
+
+
+class ReadWriteLock:
+    """
+    Lets many threads read at once, or one thread write.
+    A thread may take the read lock again while it holds it, and the
+    writing thread may take either lock again. New readers queue behind a
+    waiting writer, so a steady stream of overlapping reads can't keep a
+    writer out for good.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def reading(self):
+        """Check whether the current thread holds the read lock"""
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def read(self):
+        if self._writer == threading.get_ident():
+            # The writer already has the data to itself
+            yield
+            return
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            with self._cond:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._cond:
+                    self._readers -= 1
+                    if self._readers == 0:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            yield
+            return
+        if self.reading():
+            raise RuntimeError('Cannot change the database while holding a read lock')
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
+
+class Index:
+    """
+    A hash index over one table.
+
+    Args:
+        name: Name used to look the index up
+        keys: Function returning the list of index keys for a row
+        unique: True if each key points at exactly one row
+    """
+
+    def __init__(self, name, keys, unique=False):
+        self.name = name
+        self.keys = keys
+        self.unique = unique
+        self.entries = {}
+
+    def rebuild(self, rows):
+        """Index every row of a dict from primary key to row"""
+        self.entries = {}
+        for pk, row in rows.items():
+            self.add(pk, row)
+
+    def add(self, pk, row):
+        for key in self.keys(row):
+            if self.unique:
+                self.entries[key] = row
+            else:
+                self.entries.setdefault(key, {})[pk] = row
+
+    def remove(self, pk, row):
+        for key in self.keys(row):
+            if self.unique:
+                if self.entries.get(key) is row:
+                    del self.entries[key]
+            else:
+                bucket = self.entries.get(key)
+                if bucket is not None:
+                    bucket.pop(pk, None)
+                    if not bucket:
+                        del self.entries[key]
+
+    def replace(self, pk, old_row, new_row):
+        """Swap a row for its new version, keeping its place in each bucket"""
+        old_keys = self.keys(old_row)
+        new_keys = self.keys(new_row)
+        if old_keys != new_keys:
+            self.remove(pk, old_row)
+            self.add(pk, new_row)
+        elif self.unique:
+            for key in new_keys:
+                self.entries[key] = new_row
+        else:
+            for key in new_keys:
+                self.entries[key][pk] = new_row
+
+    def get(self, key):
+        """Get the row for a key in a unique index"""
+        return self.entries.get(key)
+
+    def find(self, key):
+        """Get the rows for a key in a non-unique index"""
+        return list(self.entries.get(key, {}).values())
+
+    def pks(self, key):
+        """Get the primary keys for a key in a non-unique index"""
+        return self.entries.get(key, {}).keys()
+
+    def count(self, key):
+        """Count the rows for a key in a non-unique index"""
+        return len(self.entries.get(key, ()))
+
+
+class SortedIndex(Index):
+    """
+    An index kept as a sorted list of (key, primary key), for finding keys
+    by prefix with bisect. Adding or removing a row moves the list entries
+    after it, which is quick even for a few million entries.
+
+    Args:
+        name: Name used to look the index up
+        keys: Function returning the list of index keys for a row (strings,
+            without repeats)
+    """
+
+    def __init__(self, name, keys):
+        super().__init__(name, keys)
+        self.entries = []
+
+    def rebuild(self, rows):
+        self.entries = sorted((key, pk) for pk, row in rows.items() for key in self.keys(row))
+
+    def add(self, pk, row):
+        for key in self.keys(row):
+            insort(self.entries, (key, pk))
+
+    def remove(self, pk, row):
+        for key in self.keys(row):
+            i = bisect_left(self.entries, (key, pk))
+            if i < len(self.entries) and self.entries[i] == (key, pk):
+                del self.entries[i]
+
+    def replace(self, pk, old_row, new_row):
+        if self.keys(old_row) != self.keys(new_row):
+            self.remove(pk, old_row)
+            self.add(pk, new_row)
+
+    def prefix(self, prefix):
+        """Get the primary keys of the rows with a key starting with prefix"""
+        pks = set()
+        # (prefix,) sorts before every (key, pk) with key >= prefix
+        for i in range(bisect_left(self.entries, (prefix,)), len(self.entries)):
+            key, pk = self.entries[i]
+            if not key.startswith(prefix):
+                break
+            pks.add(pk)
+        return pks
+
+
+class Table:
+    """
+    One collection of rows, stored as a dict from primary key to row.
+    Rows are never changed in place - an update puts a new dict.
+
+    Tables keyed by 'id' keep a sequence: the highest ID ever used. It is
+    saved in the snapshot and only ever goes up, so new IDs cost O(1) and
+    IDs of deleted rows are never handed out again.
+    """
+
+    def __init__(self, name, key='id', indexes=()):
+        self.name = name
+        self.key = key
+        self.rows = {}
+        self.indexes = {index.name: index for index in indexes}
+        self.last_id = 0
+
+    def load_records(self, records):
+        """Fill the table from the records stored in the snapshot"""
+        self.rows = {record[self.key]: record for record in records}
+        if self.key == 'id':
+            self.last_id = max(self.last_id, max(self.rows, default=0))
+        self.reindex()
+
+    def dump_records(self):
+        """Get the records to write into the snapshot"""
+        return list(self.rows.values())
+
+    def next_id(self):
+        """Get the ID for a new row"""
+        return self.last_id + 1
+
+    def reindex(self):
+        """Rebuild every index from the rows"""
+        for index in self.indexes.values():
+            index.rebuild(self.rows)
+
+    def set(self, row):
+        """Insert or replace a row, keeping the indexes up to date"""
+        pk = row[self.key]
+        old_row = self.rows.get(pk)
+        self.rows[pk] = row
+        if self.key == 'id' and pk > self.last_id:
+            self.last_id = pk
+        for index in self.indexes.values():
+            if old_row is None:
+                index.add(pk, row)
+            else:
+                index.replace(pk, old_row, row)
+
+    def remove(self, pk):
+        """Delete a row, keeping the indexes up to date"""
+        row = self.rows.pop(pk, None)
+        if row is not None:
+            for index in self.indexes.values():
+                index.remove(pk, row)
+
+
+def _file_stamp(path):
+    """Identify the current version of a file (None if it doesn't exist)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _journal_header(path):
+    """Read the header of a journal file ({} if it has none)"""
+    try:
+        with open(path, 'rb') as f:
+            line = f.readline()
+        record = json.loads(line) if line.endswith(b'\n') else {}
+    except (OSError, ValueError):
+        return {}
+    return record if record.get('op') == 'journal' else {}
+
+
+class Shard:
+    """
+    The files of one table: its snapshot and its journal.
+    The caller must hold the store lock for everything except changed().
+
+    Args:
+        table: The Table stored in these files
+        data_dir: Folder holding the files
+    """
+
+    def __init__(self, table, data_dir):
+        self.table = table
+        self.snapshot_file = os.path.join(data_dir, table.name + '.json')
+        self.journal_file = os.path.join(data_dir, table.name + '.journal')
+        self.pending_file = self.journal_file + '.compacting'
+        self.previous_file = self.journal_file + '.previous'
+
+        self.journal_records = 0
+        self.compacting = False
+        # True while this process writes or compacts the files - the table
+        # in memory is up to date then even though the journal has changed
+        self.writing = False
+        self._journal = None
+        # What we have read so far, to notice changes made by other processes
+        self._snapshot_stamp = None
+        self._journal_inode = None
+        self._journal_offset = 0
+        # The generation of the journal we are on (None for a journal
+        # written before journals had headers)
+        self._generation = None
+
+    def exists(self):
+        return os.path.exists(self.snapshot_file) or os.path.exists(self.journal_file)
+
+    def load(self):
+        """Read the snapshot and replay any journal records on top of it"""
+        if self._journal:
+            self._journal.close()
+
+        self._snapshot_stamp = _file_stamp(self.snapshot_file)
+        if self._snapshot_stamp:
+            with open(self.snapshot_file, 'r') as f:
+                data = json.load(f)
+            # Snapshots are {"last_id": 12, "rows": [...]} - a bare list of
+            # rows is the older format without the sequence
+            if isinstance(data, list):
+                data = {'rows': data}
+            self.table.last_id = max(self.table.last_id, data.get('last_id', 0))
+            self.table.load_records(data['rows'])
+        else:
+            self.table.load_records([])
+
+        # A leftover .compacting file means a compaction didn't finish.
+        # Its records are older than the ones in the live journal.
+        self._replay(self.pending_file)
+
+        self._open_journal()
+
+    def _open_journal(self):
+        """Open the live journal and replay all of it"""
+        self._journal = open(self.journal_file, 'ab')
+        self._journal_inode = os.fstat(self._journal.fileno()).st_ino
+        self._generation = None
+        self._journal_offset, self.journal_records = self._replay(self.journal_file)
+
+    def _replay(self, path, offset=0):
+        """
+        Apply the complete records of a journal file from an offset.
+        Returns the offset after the last good record and how many were applied.
+        """
+        if not os.path.exists(path):
+            return 0, 0
+
+        count = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # A missing newline or bad JSON means the last write was cut
+                # off by a crash - everything before it is still valid
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                if record['op'] == 'journal':
+                    # The header - only the live journal's counts
+                    if path == self.journal_file:
+                        self._generation = record['generation']
+                    continue
+                self.apply(record)
+                count += 1
+
+        # Drop the torn tail so new records don't get glued onto it
+        if offset != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+        return offset, count
+
+    def changed(self):
+        """Check (without locking) whether another process touched the files"""
+        try:
+            st = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return True
+        return st.st_ino != self._journal_inode or st.st_size != self._journal_offset
+
+    def catch_up(self):
+        """Bring the table up to date with the files on disk"""
+        if not self.changed():
+            return
+        try:
+            journal_inode = os.stat(self.journal_file).st_ino
+        except FileNotFoundError:
+            journal_inode = None
+
+        if journal_inode == self._journal_inode and \
+                _file_stamp(self.snapshot_file) == self._snapshot_stamp:
+            # Someone appended to the journal - replay just the new records
+            self._journal_offset, count = self._replay(self.journal_file, self._journal_offset)
+            self.journal_records += count
+        elif self._finish_previous():
+            # Someone compacted the journal we were reading - the new
+            # snapshot holds nothing we don't have now, so carry on with
+            # the new journal
+            self._journal.close()
+            self._snapshot_stamp = _file_stamp(self.snapshot_file)
+            self._open_journal()
+        else:
+            # Someone compacted or replaced the table - start over from the
+            # new snapshot
+            self.load()
+
+    def start_journal(self):
+        """Give the journal a header if it is still empty"""
+        if self._journal_offset == 0:
+            self._write_header(None)
+
+    def _write_header(self, follows):
+        """Start the empty live journal with a header naming a new generation"""
+        self._generation = uuid.uuid4().hex
+        self.append({'op': 'journal', 'generation': self._generation, 'follows': follows})
+        # It isn't a change
+        self.journal_records -= 1
+
+    def _finish_previous(self):
+        """
+        If the live journal carries on from the one we were reading, replay
+        the rest of that one and return True
+        """
+        follows = _journal_header(self.journal_file).get('follows')
+        if self._generation is None or not follows or follows[0] != self._generation:
+            return False
+        generation, end = follows
+        if self._journal_offset == end:
+            return True
+        # Only the last journal folded is kept
+        if _journal_header(self.previous_file).get('generation') != generation or \
+                _file_stamp(self.previous_file)[1] != end:
+            return False
+        self._replay(self.previous_file, self._journal_offset)
+        return True
+
+    def append(self, record):
+        """
+        Make a record durable in the journal (it still has to be applied).
+        Returns the offset it starts at.
+        """
+        start = self._journal_offset
+        try:
+            self._journal.write((json.dumps(record) + '\n').encode('utf-8'))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except BaseException:
+            # Don't leave part of it behind for the next record to be glued onto
+            self._truncate(start)
+            raise
+        self._journal_offset = self._journal.tell()
+        self.journal_records += 1
+        return start
+
+    def take_back(self, start):
+        """Remove the last record appended (starting at start) - its commit failed"""
+        self._truncate(start)
+        self.journal_records -= 1
+
+    def _truncate(self, offset):
+        """Cut the journal back to offset, dropping anything still buffered"""
+        try:
+            self._journal.close()
+        except OSError:
+            pass
+        try:
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(offset)
+        except OSError:
+            # Still broken - the records stay and are read back later
+            pass
+        self._journal = open(self.journal_file, 'ab')
+        self._journal_offset = offset
+
+    def apply(self, record):
+        """Apply one journal record to the table"""
+        if record['op'] == 'put':
+            self.table.set(record['row'])
+        elif record['op'] == 'delete':
+            self.table.remove(record['key'])
+        elif record['op'] == 'batch':
+            # All the changes one transaction made to this table
+            for change in record['records']:
+                self.apply(change)
+
+    def compact(self, folded=True):
+        """
+        Fold the journal into a fresh snapshot. folded is False when the
+        table was replaced rather than built from its files, so others
+        must reload it.
+        """
+        follows = [self._generation, self._journal_offset] if folded else None
+        data = json.dumps({
+            'last_id': self.table.last_id,
+            'rows': self.table.dump_records()
+        }, indent=2)
+
+        # The old journal is kept until the snapshot that contains its
+        # records is safely on disk
+        self._journal.close()
+        self._journal = None
+        if os.path.exists(self.pending_file):
+            # An earlier compaction never finished - keep its records too
+            with open(self.journal_file, 'rb') as src, open(self.pending_file, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.journal_file)
+        elif os.path.exists(self.journal_file):
+            os.replace(self.journal_file, self.pending_file)
+
+        # Write to a temporary file and rename it over the snapshot, so
+        # other processes never see a half-written file
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        self._snapshot_stamp = _file_stamp(self.snapshot_file)
+
+        # Open the new journal while the old one still exists, so it can't
+        # get the same inode and other processes are sure to notice the swap
+        self._journal = open(self.journal_file, 'ab')
+        self._journal_inode = os.fstat(self._journal.fileno()).st_ino
+        self._journal_offset = 0
+        self.journal_records = 0
+        # Its header tells the others where the old journal was folded up
+        # to, and the old one stays around for those who haven't read all of it
+        self._write_header(follows)
+        if os.path.exists(self.pending_file):
+            os.replace(self.pending_file, self.previous_file)
+
+
+class JsonStore:
+    """
+    In-memory tables, each backed by its own snapshot and journal files.
+
+    Args:
+        data_dir: Folder holding the table files
+        tables: List of Table objects making up the database
+        compact_after: Number of journal records that triggers a compaction
+    """
+
+    def __init__(self, data_dir, tables, compact_after=1000):
+        self.data_dir = data_dir
+        self.compact_after = compact_after
+        self.tables = {table.name: table for table in tables}
+        self.shards = {table.name: Shard(table, data_dir) for table in tables}
+
+        # Writers (and readers reloading files) hold this thread lock plus
+        # the lock file; _lock_depth lets one thread take it more than once
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_pid = None
+        self._lock_depth = 0
+        # Guards the in-memory tables
+        self._rw = ReadWriteLock()
+
+        # Changes made by the open transaction: (shard, record, old row)
+        self._txn = None
+        self._intent_file = os.path.join(data_dir, 'transaction.journal')
+        self._loaded = False
+
+    def load(self, import_file=None):
+        """
+        Load every table from its files.
+
+        Args:
+            import_file: Single-file database (the old database.json format)
+                to import from when the data folder is still empty
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self.write_lock():
+            is_new = not any(shard.exists() for shard in self.shards.values())
+
+            with self._rw.write():
+                for shard in self.shards.values():
+                    shard.load()
+                    shard.start_journal()
+            self._loaded = True
+            self._recover()
+
+            if is_new and import_file and os.path.exists(import_file):
+                self.import_file(import_file)
+
+    def import_file(self, path):
+        """Replace the whole database with a single-file JSON database"""
+        with open(path, 'r') as f:
+            self.replace(json.load(f))
+
+    # Locking
+
+    def _flock(self, operation, blocking=True):
+        """
+        Lock or unlock data/.lock - operation is 'LOCK_SH', 'LOCK_EX' or
+        'LOCK_UN'. Returns False if blocking is False and the lock is taken.
+        """
+        if fcntl is None:
+            return True
+        # A forked worker shares its parent's open file, and flock doesn't
+        # separate the two - so every process opens the lock file itself
+        if self._lock_pid != os.getpid():
+            self._lock_file = open(os.path.join(self.data_dir, '.lock'), 'a')
+            self._lock_pid = os.getpid()
+        flags = getattr(fcntl, operation)
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._lock_file.fileno(), flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Hold the write lock of the whole store, against other threads and
+        other processes. Use it around read-check-write sequences.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                self._flock('LOCK_EX')
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and self._loaded:
+                    self._recover()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._flock('LOCK_UN')
+
+    def refresh(self, table):
+        """Reload a table if another process changed its files"""
+        shard = self.shards[table]
+        # Inside read() the view must not change, so reloading waits
+        if self._rw.reading() or not shard.changed():
+            return
+        # The journal only looks changed because of our own append or
+        # compaction - rather than wait for the disk, read what we have
+        if shard.writing:
+            return
+        # Another process wrote - wait until we have read it
+        with self._lock:
+            if self._lock_depth:
+                # Our own transaction: it holds the lock already
+                self._catch_up(shard)
+            else:
+                self._flock('LOCK_SH')
+                try:
+                    self._catch_up(shard)
+                finally:
+                    self._flock('LOCK_UN')
+
+    def _catch_up(self, shard):
+        if shard.changed():
+            with self._rw.write():
+                shard.catch_up()
+
+    @contextmanager
+    def read(self, *tables):
+        """
+        Read a consistent view of the tables: nothing changes them until the
+        block ends. The tables are refreshed from disk first (all of them if
+        none are named). Writing inside the block raises RuntimeError.
+        """
+        for table in tables or self.tables:
+            self.refresh(table)
+        with self._rw.read():
+            yield self.tables
+
+    # Writing
+
+    def insert(self, table, row):
+        """Add a new row, giving it the next ID"""
+        with self.write_lock():
+            shard = self.shards[table]
+            self._catch_up(shard)
+            row = dict(row, id=shard.table.next_id())
+            self._write(shard, {'op': 'put', 'row': row})
+        return row
+
+    def put(self, table, row):
+        """Insert or replace a row"""
+        with self.write_lock():
+            shard = self.shards[table]
+            self._catch_up(shard)
+            self._write(shard, {'op': 'put', 'row': row})
+        return row
+
+    def delete(self, table, key):
+        """Delete a row by primary key (no-op if it doesn't exist)"""
+        with self.write_lock():
+            shard = self.shards[table]
+            self._catch_up(shard)
+            if key in shard.table.rows:
+                self._write(shard, {'op': 'delete', 'key': key})
+
+    def _write(self, shard, record):
+        if self._txn is not None:
+            # Inside a transaction: apply now (no one else can see it yet),
+            # remember the old row in case we roll back, commit at the end
+            table = shard.table
+            pk = record['row'][table.key] if record['op'] == 'put' else record['key']
+            self._txn.append((shard, record, table.rows.get(pk)))
+            shard.apply(record)
+            return
+
+        # Durable first, then visible
+        shard.writing = True
+        try:
+            shard.append(record)
+            with self._rw.write():
+                shard.apply(record)
+        finally:
+            shard.writing = False
+        self._maybe_compact(shard)
+
+    def _maybe_compact(self, shard):
+        if shard.journal_records >= self.compact_after and not shard.compacting:
+            shard.compacting = True
+            threading.Thread(target=self.compact, args=(shard.table.name,), daemon=True).start()
+
+    # Transactions
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several reads and writes into one unit of work. Other writers
+        wait until it ends and readers see either all of its changes or none.
+        The changes are committed with one journal write per table at the
+        end; if the block or the commit raises, they are all undone. Nested
+        transactions join the outer one.
+        """
+        with self.write_lock():
+            if self._txn is not None:
+                yield
+                return
+
+            self._txn = []
+            try:
+                # The changes are applied as they are made, so the block can
+                # read them back, while readers are kept out. They are taken
+                # out again at the end and only come back once they are in
+                # the journal - readers carry on while it is written.
+                with self._rw.write():
+                    try:
+                        yield
+                    finally:
+                        self._rollback()
+                self._commit()
+            finally:
+                self._txn = None
+
+    def _rollback(self):
+        for shard, record, old_row in reversed(self._txn):
+            table = shard.table
+            if old_row is not None:
+                table.set(old_row)
+            elif record['op'] == 'put':
+                table.remove(record['row'][table.key])
+
+    def _commit(self):
+        # Collect the records of each table, in order
+        changes = {}
+        for shard, record, _ in self._txn:
+            changes.setdefault(shard.table.name, []).append(record)
+        if not changes:
+            return
+
+        # Durable first, holding only the store lock
+        shards = [self.shards[name] for name in changes]
+        for shard in shards:
+            shard.writing = True
+        written = []
+        try:
+            try:
+                if len(changes) > 1:
+                    self._write_intent(changes)
+                for shard, records in zip(shards, changes.values()):
+                    record = records[0] if len(records) == 1 else {'op': 'batch', 'records': records}
+                    written.append((shard, shard.append(record), record))
+                if len(changes) > 1:
+                    self._write_intent(None)
+            except BaseException:
+                # Take back what made it to disk, so the failed transaction
+                # doesn't come back at the next catch-up or recovery
+                for shard, start, _ in written:
+                    shard.take_back(start)
+                if len(changes) > 1:
+                    self._write_intent(None)
+                raise
+
+            # Then visible, all at once
+            with self._rw.write():
+                for shard, _, record in written:
+                    shard.apply(record)
+        finally:
+            for shard in shards:
+                shard.writing = False
+        for shard in shards:
+            self._maybe_compact(shard)
+
+    def _write_intent(self, changes):
+        """Save the records of a transaction that spans tables (None clears it)"""
+        with open(self._intent_file, 'w') as f:
+            if changes:
+                f.write(json.dumps(changes) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _recover(self):
+        """Finish the commit of a transaction that was cut off by a crash"""
+        if not os.path.exists(self._intent_file) or os.path.getsize(self._intent_file) == 0:
+            return
+        with open(self._intent_file, 'rb') as f:
+            line = f.readline()
+        try:
+            changes = json.loads(line) if line.endswith(b'\n') else None
+        except ValueError:
+            changes = None
+
+        # No complete intent means the crash came before any table was
+        # touched. Otherwise write every table again: records are idempotent,
+        # so the tables that were already written end up the same.
+        if changes:
+            for name, records in changes.items():
+                shard = self.shards[name]
+                self._catch_up(shard)
+                record = {'op': 'batch', 'records': records}
+                shard.append(record)
+                with self._rw.write():
+                    shard.apply(record)
+        self._write_intent(None)
+
+    # Snapshots
+
+    def export(self):
+        """Get the whole database as a dict of record lists"""
+        with self.write_lock():
+            data = {}
+            for name, shard in self.shards.items():
+                self._catch_up(shard)
+                data[name] = shard.table.dump_records()
+            return data
+
+    def replace(self, data):
+        """Replace every table with the records in a dict of lists"""
+        with self.write_lock():
+            for name, shard in self.shards.items():
+                with self._rw.write():
+                    shard.table.load_records(data.get(name, []))
+                shard.compact(folded=False)
+
+    def compact(self, table=None):
+        """Fold the journal of one table (or all of them) into a fresh snapshot"""
+        names = [table] if table else list(self.shards)
+        with self.write_lock():
+            for name in names:
+                shard = self.shards[name]
+                try:
+                    self._catch_up(shard)
+                    # Compacting changes no data
+                    shard.writing = True
+                    shard.compact()
+                finally:
+                    shard.writing = False
+                    shard.compacting = False
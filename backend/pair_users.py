@@ -0,0 +1,234 @@
+"""
+Pairing round - give every user a new match in one go.
+
+Calling /api/matches/find for every user scores everyone again each time.
+This job reads all interests once, then:
+1. Scores each user's best candidates in parallel (a pool of processes),
+   with score_sets from app/matching.py. People who already have a match
+   together, active or archived, are skipped - create_match would hand
+   back the old match instead of making a new one.
+2. Pairs people up, best scores first, so everyone is in at most one new
+   pair. People left over (nobody shares an interest with them) are paired
+   with each other.
+3. Saves the pairs with create_match, a batch per transaction.
+
+Progress is saved to a state file as it goes, starting with the list of
+users in the round. If the job is interrupted, running it again continues
+where it stopped with the same users (use --fresh to start over).
+
+Usage:
+    python pair_users.py
+    python pair_users.py --workers 8 --dry-run
+"""
+
+import argparse
+import heapq
+import json
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool
+from json_db import get_all_users, get_all_user_interests, get_user_matches, create_match, transaction
+from app.matching import rank_key, score_sets
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(BASE_DIR, 'pairing_state.jsonl')
+
+
+# Scoring (runs in the worker processes)
+
+_id_sets = None
+_postings = None
+_matched = None
+
+def _init_worker(id_sets, postings, matched):
+    """Give a worker process the data it scores with"""
+    global _id_sets, _postings, _matched
+    _id_sets = id_sets
+    _postings = postings
+    _matched = matched
+
+def _score_chunk(task):
+    """Find the best candidates of a chunk of users"""
+    chunk_number, user_ids, top = task
+    best = {}
+    for user_id in user_ids:
+        mine = _id_sets.get(user_id, frozenset())
+        # Only people who share an interest can score above 0
+        candidates = set()
+        for interest_id in mine:
+            candidates.update(_postings[interest_id])
+        candidates.discard(user_id)
+        candidates.difference_update(_matched.get(user_id, ()))
+
+        scored = [(score_sets(mine, _id_sets[other_id]), other_id) for other_id in candidates]
+        best[user_id] = heapq.nsmallest(top, [item for item in scored if item[0] > 0], key=rank_key)
+    return chunk_number, best
+
+# State file
+
+def _load_state(path):
+    """Read what an interrupted run got done: its users, scored chunks, the plan, pairs written"""
+    state = {'users': None, 'chunks': {}, 'plan': None, 'written': 0}
+    if not os.path.exists(path):
+        return state
+    good = 0
+    with open(path, 'rb+') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('incomplete line')
+                record = json.loads(line)
+            except ValueError:
+                # Cut off by the interruption - everything before it is
+                # fine, and new progress goes after it
+                f.truncate(good)
+                break
+            good += len(line)
+            if 'users' in record:
+                state['users'] = record['users']
+            elif 'chunk' in record:
+                state['chunks'][record['chunk']] = {int(k): v for k, v in record['best'].items()}
+            elif 'plan' in record:
+                state['plan'] = record['plan']
+            elif 'written' in record:
+                state['written'] = record['written']
+    return state
+
+def _save(state_file, record):
+    if state_file is None:
+        return
+    state_file.write(json.dumps(record) + '\n')
+    state_file.flush()
+    os.fsync(state_file.fileno())
+
+
+# Pairing
+
+def _pair_up(user_ids, best, matched):
+    """
+    Pair users greedily, best score first. Returns a list of
+    [user1_id, user2_id, score].
+    """
+    proposals = set()
+    for user_id, candidates in best.items():
+        for score, other_id in candidates:
+            proposals.add((score, min(user_id, other_id), max(user_id, other_id)))
+
+    paired = set()
+    plan = []
+    for score, user1_id, user2_id in sorted(proposals, key=lambda p: (-p[0], p[1], p[2])):
+        if user1_id not in paired and user2_id not in paired:
+            paired.update((user1_id, user2_id))
+            plan.append([user1_id, user2_id, score])
+
+    # Everyone left gets paired with the next one left they haven't
+    # been matched with - only those are skipped, and they stay in line
+    left = deque(user_id for user_id in user_ids if user_id not in paired)
+    while len(left) > 1:
+        user_id = left.popleft()
+        skipped = []
+        while left and left[0] in matched.get(user_id, ()):
+            skipped.append(left.popleft())
+        if left:
+            other_id = left.popleft()
+            plan.append([min(user_id, other_id), max(user_id, other_id), 0])
+        left.extendleft(reversed(skipped))
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='scoring processes')
+    parser.add_argument('--chunk-size', type=int, default=500, help='users per scoring task')
+    parser.add_argument('--top', type=int, default=20, help='candidates kept per user')
+    parser.add_argument('--batch-size', type=int, default=500, help='matches saved per transaction')
+    parser.add_argument('--state', default=STATE_FILE, help='where progress is saved')
+    parser.add_argument('--fresh', action='store_true', help='ignore an interrupted run and start over')
+    parser.add_argument('--dry-run', action='store_true', help='print the pairs instead of saving them')
+    args = parser.parse_args()
+
+    if args.fresh and os.path.exists(args.state):
+        os.remove(args.state)
+    state = _load_state(args.state)
+    if state['users'] is not None:
+        print('Continuing an interrupted run (%s)' % args.state)
+    started = time.perf_counter()
+
+    # Everything the scoring needs, read once. The chunks saved by an
+    # interrupted run are numbered in its list of users, so that list is
+    # kept even if users joined or left since
+    user_ids = state['users']
+    if user_ids is None:
+        user_ids = sorted(user['id'] for user in get_all_users())
+    matched = {}
+    for user_id in user_ids:
+        for match in get_user_matches(user_id, active_only=False):
+            other_id = match['user2_id'] if match['user1_id'] == user_id else match['user1_id']
+            matched.setdefault(user_id, set()).add(other_id)
+
+    # A dry run doesn't save any progress
+    with (nullcontext() if args.dry_run else open(args.state, 'a')) as state_file:
+        if state['users'] is None:
+            _save(state_file, {'users': user_ids})
+        plan = state['plan']
+        if plan is None:
+            # 1. Score, skipping chunks an earlier run already did
+            interest_ids = {}
+            id_sets = {}
+            postings = {}
+            for user_id, interests in get_all_user_interests().items():
+                id_sets[user_id] = frozenset(interest_ids.setdefault(name, len(interest_ids)) for name in interests)
+                for interest_id in id_sets[user_id]:
+                    postings.setdefault(interest_id, []).append(user_id)
+
+            chunks = [user_ids[i:i + args.chunk_size] for i in range(0, len(user_ids), args.chunk_size)]
+            tasks = [(n, chunk, args.top) for n, chunk in enumerate(chunks) if n not in state['chunks']]
+            best = {}
+            for chunk_best in state['chunks'].values():
+                best.update(chunk_best)
+
+            scored = 0
+            scoring_started = time.perf_counter()
+            with Pool(args.workers, _init_worker, (id_sets, postings, matched)) as pool:
+                for chunk_number, chunk_best in pool.imap_unordered(_score_chunk, tasks):
+                    _save(state_file, {'chunk': chunk_number, 'best': chunk_best})
+                    best.update(chunk_best)
+                    scored += len(chunk_best)
+                    elapsed = time.perf_counter() - scoring_started
+                    print('Scored %d/%d users (%.0f users/s)' % (
+                        len(best), len(user_ids), scored / elapsed if elapsed else 0))
+
+            # 2. Pair up
+            plan = _pair_up(user_ids, best, matched)
+            _save(state_file, {'plan': plan})
+        print('%d pairs' % len(plan))
+
+        if args.dry_run:
+            for user1_id, user2_id, score in plan:
+                print('%d - %d (%d%%)' % (user1_id, user2_id, score))
+            return
+
+        # 3. Save, a batch at a time, after what an earlier run saved
+        written = state['written']
+        saving_started = time.perf_counter()
+        for start in range(written, len(plan), args.batch_size):
+            with transaction():
+                for user1_id, user2_id, score in plan[start:start + args.batch_size]:
+                    # Returns the existing match if there already is one
+                    create_match(user1_id, user2_id, score)
+            written = min(start + args.batch_size, len(plan))
+            _save(state_file, {'written': written})
+            elapsed = time.perf_counter() - saving_started
+            print('Saved %d/%d matches (%.0f matches/s)' % (
+                written, len(plan), (written - state['written']) / elapsed if elapsed else 0))
+
+    # Done - the next run is a new round
+    if os.path.exists(args.state):
+        os.remove(args.state)
+    print('Finished in %.1fs' % (time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Password hashing - bcrypt, run on a small pool of worker threads.
+
+bcrypt is slow on purpose (a few hundred milliseconds at cost 12). It
+releases the GIL while it works, so running it on PASSWORD_WORKERS threads
+of its own keeps a burst of signups and logins from taking up every server
+thread: other requests carry on while the pool is busy. At most
+PASSWORD_QUEUE_LIMIT more hashes can wait for a worker - past that,
+PasswordQueueFull is raised right away instead of queueing up more work.
+
+New hashes use Config.BCRYPT_ROUNDS. Hashes made with a different cost
+still check fine, and needs_rehash tells verify_user to replace them.
+"""
+
+import os
+import threading
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+
+class PasswordQueueFull(Exception):
+    """Too many password hashes are waiting for a worker already"""
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# One slot per hash running or waiting
+_slots = threading.BoundedSemaphore(Config.PASSWORD_WORKERS + Config.PASSWORD_QUEUE_LIMIT)
+
+def _get_pool():
+    """Get the worker pool, starting it on first use"""
+    global _pool, _pool_pid
+    # A forked worker process doesn't get its parent's threads, so every
+    # process starts its own pool
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(Config.PASSWORD_WORKERS, thread_name_prefix='bcrypt')
+                _pool_pid = os.getpid()
+    return _pool
+
+def _run(function, *args):
+    """Run function on the pool and wait for its result"""
+    if not _slots.acquire(blocking=False):
+        raise PasswordQueueFull()
+    try:
+        return _get_pool().submit(function, *args).result()
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    """Hash a password using bcrypt"""
+    salt = bcrypt.gensalt(Config.BCRYPT_ROUNDS)
+    hashed = _run(bcrypt.hashpw, password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+def check_password(password, password_hash):
+    """Check if password matches hash"""
+    return _run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def needs_rehash(password_hash):
+    """Check if a hash was made with a different cost than BCRYPT_ROUNDS"""
+    # A bcrypt hash looks like $2b$12$<salt and hash>, 12 being the cost
+    try:
+        return int(password_hash.split('$')[2]) != Config.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
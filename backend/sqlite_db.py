@@ -0,0 +1,773 @@
+"""
+SQLite database - the same functions as json_db.py, stored in SQLite.
+Turn it on with DATABASE_BACKEND=sqlite (see config.py); json_db.py then
+hands out these functions instead of its own, so the routes don't change.
+
+The database runs in WAL mode so readers never wait for the writer.
+Connections are kept in a small pool and each thread holds one connection
+for as long as it is inside a database call.
+"""
+
+import json
+import heapq
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+from passwords import hash_password, check_password
+from db_common import (
+    interest_key, SEARCH_GRAM, search_grams, search_words, query_grams, search_tier, search_key,
+    decline_cutoff, check_login
+)
+
+__all__ = [
+    'hash_password', 'check_password', 'load_db', 'save_db', 'read_view', 'transaction', 'catch_up',
+    'get_user_by_email', 'get_user_by_id', 'get_users_by_ids', 'create_user', 'verify_user',
+    'update_user', 'on_users_changed', 'interest_key', 'get_user_interests', 'get_all_user_interests', 'get_interest_sets',
+    'get_interest_overlap', 'set_user_interests', 'on_interests_changed',
+    'create_match', 'get_user_matches', 'archive_match', 'get_all_users', 'find_users',
+    'decline_user', 'get_declined_user_ids',
+    'follow_user', 'unfollow_user', 'is_following', 'on_follows_changed',
+    'get_follower_count', 'get_following_count', 'get_follow_stats', 'get_following_ids',
+    'get_match_note', 'get_match_notes', 'save_match_note', 'delete_match_note'
+]
+
+# Seed data imported into a brand new database
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(BASE_DIR, 'database.json')
+
+# Bump when SCHEMA changes in a way IF NOT EXISTS can't handle, and
+# migrate the older versions in _ensure_schema
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    name TEXT,
+    bio TEXT,
+    profile_picture TEXT,
+    created_at TEXT
+);
+
+-- For find_users, kept up to date by create_user and update_user: the
+-- pieces of 3 letters of each user's name and email (lower case), and the
+-- texts shorter queries are matched against by prefix (search_words)
+CREATE TABLE IF NOT EXISTS user_grams (
+    gram TEXT NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    PRIMARY KEY (gram, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_grams_user ON user_grams(user_id);
+CREATE TABLE IF NOT EXISTS user_words (
+    word TEXT NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    PRIMARY KEY (word, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_words_user ON user_words(user_id);
+
+-- Every different interest once (key is the name in lower case with
+-- single spaces). Users' interests refer to it by ID, in their order
+CREATE TABLE IF NOT EXISTS interest_names (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_interests (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    position INTEGER NOT NULL,
+    interest_id INTEGER NOT NULL REFERENCES interest_names(id),
+    PRIMARY KEY (user_id, position),
+    UNIQUE (user_id, interest_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_interests_interest ON user_interests(interest_id, user_id);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user1_id INTEGER NOT NULL REFERENCES users(id),
+    user2_id INTEGER NOT NULL REFERENCES users(id),
+    user1_accepted INTEGER NOT NULL DEFAULT 1,
+    user2_accepted INTEGER NOT NULL DEFAULT 1,
+    match_score INTEGER NOT NULL DEFAULT 0,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT,
+    archived_at TEXT,
+    UNIQUE (user1_id, user2_id)
+);
+CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches(user2_id);
+
+CREATE TABLE IF NOT EXISTS follows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    follower_id INTEGER NOT NULL REFERENCES users(id),
+    followed_id INTEGER NOT NULL REFERENCES users(id),
+    created_at TEXT,
+    UNIQUE (follower_id, followed_id)
+);
+CREATE INDEX IF NOT EXISTS idx_follows_followed ON follows(followed_id);
+-- Each user's follow numbers, kept up to date by follow_user and
+-- unfollow_user so reading them doesn't count rows
+CREATE TABLE IF NOT EXISTS follow_counts (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    followers INTEGER NOT NULL DEFAULT 0,
+    following INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    match_id INTEGER NOT NULL REFERENCES matches(id),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    note_text TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    UNIQUE (match_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS declines (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    declined_id INTEGER NOT NULL REFERENCES users(id),
+    declined_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, declined_id)
+) WITHOUT ROWID;
+'''
+
+# Columns update_user is allowed to change
+USER_COLUMNS = {'password_hash', 'name', 'bio', 'profile_picture', 'created_at'}
+
+# Connection pool
+_pool = queue.LifoQueue(maxsize=Config.SQLITE_POOL_SIZE)
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def _open_connection():
+    """Open a new connection with our settings"""
+    conn = sqlite3.connect(Config.SQLITE_PATH, timeout=30, isolation_level=None,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+@contextmanager
+def _connection():
+    """Borrow a connection from the pool for the current thread"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        # Nested call in the same thread - keep using its connection
+        yield conn
+        return
+
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection()
+    _ensure_schema(conn)
+
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+@contextmanager
+def transaction():
+    """
+    Run a block of statements as one write transaction. Changes reported
+    to the on_..._changed callbacks inside it are passed on once it is
+    committed (and dropped if it is rolled back).
+    """
+    with _connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        _local.changes = []
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+            changes = _local.changes
+        finally:
+            _local.changes = None
+        for listeners, user_id in changes:
+            for callback in listeners:
+                callback(user_id)
+
+def _changed(listeners, user_id):
+    """Report a change to listeners, after the transaction it is part of commits"""
+    changes = getattr(_local, 'changes', None)
+    if changes is not None:
+        changes.append((listeners, user_id))
+        return
+    for callback in listeners:
+        callback(user_id)
+
+def catch_up(*tables):
+    """
+    Nothing to read - every query sees the latest data. Changes other
+    processes make aren't reported to the on_..._changed callbacks.
+    """
+
+@contextmanager
+def read_view():
+    """
+    Run several reads against one consistent snapshot of the database.
+    In WAL mode a read transaction keeps seeing the data as it was when it
+    started, and writers in other threads carry on without waiting.
+    """
+    with _connection() as conn:
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute('BEGIN')
+        try:
+            yield
+        finally:
+            conn.execute('COMMIT')
+
+def _ensure_schema(conn):
+    """Create the tables (and import the seed data) the first time"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Every statement is IF NOT EXISTS, so this also adds tables
+            # and indexes that are newer than the database
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            # user_version is 0 in a database we haven't set up yet
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version == 0 and os.path.exists(DB_FILE):
+                with open(DB_FILE, 'r') as f:
+                    _import(conn, json.load(f))
+            conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        _schema_ready = True
+
+def _import(conn, data):
+    """Insert the records of a single-file JSON database"""
+    for user in data.get('users', []):
+        conn.execute(
+            'INSERT INTO users (id, email, password_hash, name, bio, profile_picture, created_at) '
+            'VALUES (:id, :email, :password_hash, :name, :bio, :profile_picture, :created_at)',
+            {column: user.get(column) for column in USER_COLUMNS | {'id', 'email'}}
+        )
+        _store_grams(conn, user)
+    interests = {}
+    for interest in data.get('interests', []):
+        interests.setdefault(interest['user_id'], []).append(interest['interest_name'])
+    for user_id, names in interests.items():
+        _store_interests(conn, user_id, names)
+    for match in data.get('matches', []):
+        conn.execute(
+            'INSERT INTO matches (id, user1_id, user2_id, user1_accepted, user2_accepted, '
+            'match_score, is_active, created_at, archived_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (match['id'], match['user1_id'], match['user2_id'],
+             match.get('user1_accepted', True), match.get('user2_accepted', True),
+             match.get('match_score', 0), match.get('is_active', True),
+             match.get('created_at'), match.get('archived_at'))
+        )
+    for follow in data.get('follows', []):
+        conn.execute('INSERT INTO follows (id, follower_id, followed_id, created_at) VALUES (?, ?, ?, ?)',
+                     (follow['id'], follow['follower_id'], follow['followed_id'], follow.get('created_at')))
+    _count_follows(conn)
+    for note in data.get('notes', []):
+        conn.execute(
+            'INSERT INTO notes (id, match_id, user_id, note_text, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (note['id'], note['match_id'], note['user_id'], note.get('note_text', ''),
+             note.get('created_at'), note.get('updated_at'))
+        )
+    for decline in data.get('declines', []):
+        conn.execute('INSERT INTO declines (user_id, declined_id, declined_at) VALUES (?, ?, ?)',
+                     (decline['user_id'], decline['declined_id'], decline['declined_at']))
+
+def _count_follows(conn):
+    """Work out every user's follow numbers from the follows table"""
+    conn.execute('DELETE FROM follow_counts')
+    conn.execute(
+        'INSERT INTO follow_counts (user_id, followers, following) '
+        'SELECT user_id, SUM(followers), SUM(following) FROM ('
+        'SELECT followed_id AS user_id, 1 AS followers, 0 AS following FROM follows '
+        'UNION ALL SELECT follower_id, 0, 1 FROM follows) GROUP BY user_id'
+    )
+
+def _add_follow_counts(conn, follower_id, followed_id, change):
+    """Add change (1 or -1) to both sides' follow numbers"""
+    for user_id, followers, following in ((followed_id, change, 0), (follower_id, 0, change)):
+        conn.execute(
+            'INSERT INTO follow_counts (user_id, followers, following) VALUES (?, ?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET followers = followers + excluded.followers, '
+            'following = following + excluded.following',
+            (user_id, followers, following)
+        )
+
+def _chunks(ids):
+    """Split a list of IDs into lists short enough for SQLite's limit on ? parameters"""
+    return [ids[start:start + 500] for start in range(0, len(ids), 500)]
+
+def _match(row):
+    """Turn a matches row into the same dict json_db returns"""
+    if row is None:
+        return None
+    match = dict(row)
+    for key in ('user1_accepted', 'user2_accepted', 'is_active'):
+        match[key] = bool(match[key])
+    return match
+
+def _row(row):
+    return dict(row) if row is not None else None
+
+def load_db():
+    """Get a copy of the whole database as a dict of lists"""
+    with _connection() as conn:
+        return {
+            'users': [dict(r) for r in conn.execute('SELECT * FROM users ORDER BY id')],
+            'interests': [dict(r) for r in conn.execute(
+                'SELECT ui.user_id, n.name AS interest_name FROM user_interests ui '
+                'JOIN interest_names n ON n.id = ui.interest_id ORDER BY ui.user_id, ui.position')],
+            'matches': [_match(r) for r in conn.execute('SELECT * FROM matches ORDER BY id')],
+            'follows': [dict(r) for r in conn.execute('SELECT * FROM follows ORDER BY id')],
+            'notes': [dict(r) for r in conn.execute('SELECT * FROM notes ORDER BY id')],
+            'declines': [dict(r) for r in conn.execute('SELECT * FROM declines')]
+        }
+
+def save_db(data):
+    """Replace the whole database"""
+    with transaction() as conn:
+        for table in ('declines', 'notes', 'follows', 'matches', 'user_interests', 'user_words', 'user_grams', 'users'):
+            conn.execute('DELETE FROM ' + table)
+        _import(conn, data)
+    _changed(_user_listeners, None)
+
+# Functions called with a user ID when that user's record changes
+_user_listeners = []
+
+def on_users_changed(callback):
+    """
+    Call callback(user_id) whenever a user is added or changed (None: the
+    whole database was replaced). Only changes made by this process are
+    reported - SQLite doesn't tell us about others.
+    """
+    _user_listeners.append(callback)
+
+# User functions
+def get_user_by_email(email):
+    """Get user by email"""
+    with _connection() as conn:
+        return _row(conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone())
+
+def get_user_by_id(user_id):
+    """Get user by ID"""
+    with _connection() as conn:
+        return _row(conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone())
+
+def get_users_by_ids(user_ids):
+    """Get several users at once, as user_id -> user (IDs with no user are left out)"""
+    user_ids = list(user_ids)
+    users = {}
+    with _connection() as conn:
+        for chunk in _chunks(user_ids):
+            for row in conn.execute('SELECT * FROM users WHERE id IN (%s)' % ', '.join('?' * len(chunk)), chunk):
+                users[row['id']] = dict(row)
+    return users
+
+def create_user(email, password, name, bio='', profile_picture=None):
+    """Create a new user"""
+    # Hash before opening the transaction - bcrypt is slow on purpose
+    password_hash = hash_password(password)
+
+    with transaction() as conn:
+        # Check if user already exists
+        if get_user_by_email(email):
+            return None
+
+        cursor = conn.execute(
+            'INSERT INTO users (email, password_hash, name, bio, profile_picture, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (email, password_hash, name, bio, profile_picture, datetime.utcnow().isoformat())
+        )
+        new_user = get_user_by_id(cursor.lastrowid)
+        _store_grams(conn, new_user)
+
+        # Automatically create match with Maddie
+        maddie = get_user_by_email('maddie.cush@northeastern.edu')
+        if maddie and maddie['id'] != new_user['id']:
+            create_match(new_user['id'], maddie['id'], 95)
+
+    return new_user
+
+def verify_user(email, password):
+    """Verify user login"""
+    return check_login(get_user_by_email(email), password, update_user)
+
+def update_user(user_id, **kwargs):
+    """Update user fields"""
+    changes = {key: value for key, value in kwargs.items() if key in USER_COLUMNS}
+    with transaction() as conn:
+        if changes:
+            assignments = ', '.join('%s = :%s' % (key, key) for key in changes)
+            conn.execute('UPDATE users SET ' + assignments + ' WHERE id = :user_id',
+                         dict(changes, user_id=user_id))
+        user = get_user_by_id(user_id)
+        if user and 'name' in changes:
+            _store_grams(conn, user)
+    _changed(_user_listeners, user_id)
+    return user
+
+def _store_grams(conn, user):
+    """Replace a user's entries in the search tables"""
+    conn.execute('DELETE FROM user_grams WHERE user_id = ?', (user['id'],))
+    conn.executemany('INSERT INTO user_grams (gram, user_id) VALUES (?, ?)',
+                     [(gram, user['id']) for gram in search_grams(user)])
+    conn.execute('DELETE FROM user_words WHERE user_id = ?', (user['id'],))
+    conn.executemany('INSERT INTO user_words (word, user_id) VALUES (?, ?)',
+                     [(word, user['id']) for word in search_words(user)])
+
+def _store_interests(conn, user_id, names):
+    """Replace a user's interests, adding names we haven't seen before"""
+    ids = []
+    for name in names:
+        key = interest_key(name)
+        if not key:
+            continue
+        row = conn.execute('SELECT id FROM interest_names WHERE key = ?', (key,)).fetchone()
+        if row:
+            interest_id = row['id']
+        else:
+            # The first spelling we see is the one shown
+            interest_id = conn.execute('INSERT INTO interest_names (key, name) VALUES (?, ?)',
+                                       (key, ' '.join(name.split()))).lastrowid
+        if interest_id not in ids:
+            ids.append(interest_id)
+    conn.execute('DELETE FROM user_interests WHERE user_id = ?', (user_id,))
+    conn.executemany('INSERT INTO user_interests (user_id, position, interest_id) VALUES (?, ?, ?)',
+                     [(user_id, position, interest_id) for position, interest_id in enumerate(ids)])
+
+def get_user_interests(user_id):
+    """Get interests for a user"""
+    with _connection() as conn:
+        rows = conn.execute(
+            'SELECT n.name FROM user_interests ui JOIN interest_names n ON n.id = ui.interest_id '
+            'WHERE ui.user_id = ? ORDER BY ui.position', (user_id,))
+        return [row['name'] for row in rows]
+
+def get_all_user_interests():
+    """Get every user's interests as a dict from user ID to list of names"""
+    interests = {}
+    with _connection() as conn:
+        rows = conn.execute(
+            'SELECT ui.user_id, n.name FROM user_interests ui JOIN interest_names n ON n.id = ui.interest_id '
+            'ORDER BY ui.user_id, ui.position')
+        for row in rows:
+            interests.setdefault(row['user_id'], []).append(row['name'])
+    return interests
+
+# Functions called with a user ID when that user's interests change
+_interest_listeners = []
+
+def on_interests_changed(callback):
+    """
+    Call callback(user_id) whenever someone's interests change. Only changes
+    made by this process are reported - SQLite doesn't tell us about others.
+    """
+    _interest_listeners.append(callback)
+
+def get_interest_sets(user_ids):
+    """
+    Get each user's interests as a frozenset of interest IDs. Users without
+    interests get an empty set. Only compare sets from the same call.
+    """
+    user_ids = list(user_ids)
+    id_sets = {user_id: set() for user_id in user_ids}
+    with _connection() as conn:
+        for chunk in _chunks(user_ids):
+            rows = conn.execute('SELECT user_id, interest_id FROM user_interests WHERE user_id IN (%s)'
+                                % ', '.join('?' * len(chunk)), chunk)
+            for row in rows:
+                id_sets[row['user_id']].add(row['interest_id'])
+    return {user_id: frozenset(ids) for user_id, ids in id_sets.items()}
+
+def get_interest_overlap(user_id):
+    """
+    Count the interests other users share with this one.
+    Users who share none are left out.
+    """
+    with _connection() as conn:
+        rows = conn.execute(
+            'SELECT other.user_id, COUNT(*) AS shared '
+            'FROM user_interests mine JOIN user_interests other ON other.interest_id = mine.interest_id '
+            'WHERE mine.user_id = ? AND other.user_id != ? GROUP BY other.user_id',
+            (user_id, user_id))
+        return {row['user_id']: row['shared'] for row in rows}
+
+def set_user_interests(user_id, interests):
+    """Set interests for a user (names differing only in case or spaces count as one)"""
+    with transaction() as conn:
+        _store_interests(conn, user_id, interests)
+    _changed(_interest_listeners, user_id)
+
+# Match functions
+def create_match(user1_id, user2_id, match_score=0):
+    """Create a match between two users"""
+    low, high = min(user1_id, user2_id), max(user1_id, user2_id)
+    with transaction() as conn:
+        # Does nothing if the match already exists
+        conn.execute(
+            'INSERT OR IGNORE INTO matches (user1_id, user2_id, match_score, created_at) '
+            'VALUES (?, ?, ?, ?)',
+            (low, high, match_score, datetime.utcnow().isoformat())
+        )
+        return _match(conn.execute('SELECT * FROM matches WHERE user1_id = ? AND user2_id = ?',
+                                   (low, high)).fetchone())
+
+def get_user_matches(user_id, active_only=True):
+    """Get all matches for a user"""
+    query = 'SELECT * FROM matches WHERE (user1_id = :id OR user2_id = :id)'
+    if active_only:
+        query += ' AND is_active = 1'
+    with _connection() as conn:
+        return [_match(row) for row in conn.execute(query + ' ORDER BY id', {'id': user_id})]
+
+def archive_match(match_id):
+    """Archive a match"""
+    with transaction() as conn:
+        conn.execute('UPDATE matches SET is_active = 0, archived_at = ? WHERE id = ?',
+                     (datetime.utcnow().isoformat(), match_id))
+        return _match(conn.execute('SELECT * FROM matches WHERE id = ?', (match_id,)).fetchone())
+
+def get_all_users(except_user_id=None):
+    """Get all users except specified one"""
+    with _connection() as conn:
+        rows = conn.execute('SELECT * FROM users WHERE id IS NOT ? ORDER BY id',
+                            (except_user_id or None,))
+        return [dict(row) for row in rows]
+
+def find_users(query, except_user_id=None, after=None, limit=None):
+    """
+    Find the users whose name or email contains query (ignoring case),
+    best matches first: see search_tier, and equal tiers are sorted by
+    name. An empty query finds everyone, by ID. Only the users who have
+    every piece of the query in the search index are looked at; a query
+    shorter than SEARCH_GRAM only finds the users whose name, a word of
+    their name or email starts with it.
+
+    Args:
+        query: What to look for
+        except_user_id: A user to leave out (e.g. the one searching)
+        after: The (tier, user_id) the previous page ended with, or None
+        limit: How many users to return (None: all of them)
+
+    Returns:
+        (page, has_more) where page is a list of (tier, user)
+    """
+    query = query.lower()
+    with _connection() as conn:
+        if not query:
+            # Everyone, by ID - the primary key gives the page directly
+            rows = conn.execute('SELECT * FROM users WHERE id > ? AND id IS NOT ? ORDER BY id LIMIT ?',
+                                (after[1] if after else 0, except_user_id or None,
+                                 -1 if limit is None else limit + 1))
+            page = [(0, dict(row)) for row in rows]
+            return page[:limit], limit is not None and len(page) > limit
+        if len(query) >= SEARCH_GRAM:
+            grams = query_grams(query)
+            rows = conn.execute(
+                'SELECT * FROM users WHERE id IN (SELECT user_id FROM user_grams WHERE gram IN (%s) '
+                'GROUP BY user_id HAVING COUNT(*) = ?) AND id IS NOT ?' % ', '.join('?' * len(grams)),
+                [*grams, len(grams), except_user_id or None]
+            )
+        else:
+            # Every text starting with query sorts between query and the
+            # same string with its last letter one higher
+            rows = conn.execute(
+                'SELECT * FROM users WHERE id IN (SELECT user_id FROM user_words WHERE word >= ? AND word < ?) '
+                'AND id IS NOT ?', (query, query[:-1] + chr(ord(query[-1]) + 1), except_user_id or None)
+            )
+        found = []
+        for row in rows:
+            user = dict(row)
+            # The pieces can all be there without the whole query being there
+            tier = search_tier(user, query)
+            if tier is not None:
+                found.append((search_key(tier, user, query), tier, user))
+        # Where the previous page ended
+        if after:
+            tier, user_id = after
+            after_key = search_key(tier, get_user_by_id(user_id) or {'id': user_id, 'name': ''}, query)
+            found = [item for item in found if item[0] > after_key]
+    # Only the page itself has to be put in order
+    if limit is None:
+        found.sort(key=lambda item: item[0])
+    else:
+        found = heapq.nsmallest(limit + 1, found, key=lambda item: item[0])
+    page = [(tier, user) for key, tier, user in found[:limit]]
+    return page, limit is not None and len(found) > limit
+
+# Decline functions
+def decline_user(user_id, declined_id):
+    """Remember that a user declined someone (IDs that aren't numbers raise ValueError)"""
+    user_id, declined_id = int(user_id), int(declined_id)
+    with transaction() as conn:
+        conn.execute('INSERT OR REPLACE INTO declines (user_id, declined_id, declined_at) VALUES (?, ?, ?)',
+                     (user_id, declined_id, datetime.utcnow().isoformat()))
+
+        # Drop expired declines and only keep the most recent ones
+        cutoff = decline_cutoff()
+        if cutoff is not None:
+            conn.execute('DELETE FROM declines WHERE user_id = ? AND declined_at < ?', (user_id, cutoff))
+        conn.execute(
+            'DELETE FROM declines WHERE user_id = ? AND declined_id NOT IN '
+            '(SELECT declined_id FROM declines WHERE user_id = ? ORDER BY declined_at DESC LIMIT ?)',
+            (user_id, user_id, Config.DECLINE_MEMORY_SIZE))
+
+def get_declined_user_ids(user_id):
+    """Get the IDs of the people a user declined (and who haven't expired)"""
+    cutoff = decline_cutoff() or ''
+    with _connection() as conn:
+        rows = conn.execute('SELECT declined_id FROM declines WHERE user_id = ? AND declined_at >= ?',
+                            (user_id, cutoff))
+        return {row['declined_id'] for row in rows}
+
+# Follow functions
+# Functions called with a user ID when the people that user follows change
+_follow_listeners = []
+
+def on_follows_changed(callback):
+    """
+    Call callback(user_id) whenever someone follows or unfollows a user,
+    with the ID of the one who did. Only changes made by this process are
+    reported - SQLite doesn't tell us about others.
+    """
+    _follow_listeners.append(callback)
+
+def follow_user(follower_id, followed_id):
+    """Create follow relationship"""
+    with transaction() as conn:
+        # Does nothing if already following
+        cursor = conn.execute('INSERT OR IGNORE INTO follows (follower_id, followed_id, created_at) VALUES (?, ?, ?)',
+                              (follower_id, followed_id, datetime.utcnow().isoformat()))
+        if cursor.rowcount:
+            _add_follow_counts(conn, follower_id, followed_id, 1)
+        follow = _row(conn.execute('SELECT * FROM follows WHERE follower_id = ? AND followed_id = ?',
+                                   (follower_id, followed_id)).fetchone())
+    if cursor.rowcount:
+        _changed(_follow_listeners, follower_id)
+    return follow
+
+def unfollow_user(follower_id, followed_id):
+    """Remove follow relationship"""
+    with transaction() as conn:
+        cursor = conn.execute('DELETE FROM follows WHERE follower_id = ? AND followed_id = ?',
+                              (follower_id, followed_id))
+        if cursor.rowcount:
+            _add_follow_counts(conn, follower_id, followed_id, -1)
+    if cursor.rowcount:
+        _changed(_follow_listeners, follower_id)
+
+def is_following(follower_id, followed_id):
+    """Check if user is following another"""
+    with _connection() as conn:
+        row = conn.execute('SELECT 1 FROM follows WHERE follower_id = ? AND followed_id = ?',
+                           (follower_id, followed_id)).fetchone()
+        return row is not None
+
+def get_follower_count(user_id):
+    """Get number of followers"""
+    with _connection() as conn:
+        row = conn.execute('SELECT followers FROM follow_counts WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+def get_following_count(user_id):
+    """Get number of users following"""
+    with _connection() as conn:
+        row = conn.execute('SELECT following FROM follow_counts WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+def get_follow_stats(viewer_id, user_ids):
+    """
+    Get the follow numbers of several users at once, as user_id ->
+    {'is_following': viewer follows them, 'followers': n, 'following': n}
+    """
+    user_ids = list(user_ids)
+    stats = {user_id: {'is_following': False, 'followers': 0, 'following': 0} for user_id in user_ids}
+    with _connection() as conn:
+        for chunk in _chunks(user_ids):
+            marks = ', '.join('?' * len(chunk))
+            for row in conn.execute('SELECT * FROM follow_counts WHERE user_id IN (%s)' % marks, chunk):
+                stats[row['user_id']]['followers'] = row['followers']
+                stats[row['user_id']]['following'] = row['following']
+            for row in conn.execute('SELECT followed_id FROM follows WHERE follower_id = ? AND followed_id IN (%s)'
+                                    % marks, [viewer_id, *chunk]):
+                stats[row['followed_id']]['is_following'] = True
+    return stats
+
+def get_following_ids(user_ids):
+    """Get the IDs of the people each of several users follows, as user_id -> set"""
+    user_ids = list(user_ids)
+    following = {user_id: set() for user_id in user_ids}
+    with _connection() as conn:
+        for chunk in _chunks(user_ids):
+            rows = conn.execute('SELECT follower_id, followed_id FROM follows WHERE follower_id IN (%s)'
+                                % ', '.join('?' * len(chunk)), chunk)
+            for row in rows:
+                following[row['follower_id']].add(row['followed_id'])
+    return following
+
+# Notes functions
+def get_match_note(match_id, user_id):
+    """Get note for a match"""
+    with _connection() as conn:
+        return _row(conn.execute('SELECT * FROM notes WHERE match_id = ? AND user_id = ?',
+                                 (match_id, user_id)).fetchone())
+
+def get_match_notes(match_ids, user_id):
+    """Get a user's notes for several matches at once, as match_id -> note (matches without one are left out)"""
+    match_ids = list(match_ids)
+    notes = {}
+    with _connection() as conn:
+        for chunk in _chunks(match_ids):
+            rows = conn.execute('SELECT * FROM notes WHERE user_id = ? AND match_id IN (%s)'
+                                % ', '.join('?' * len(chunk)), [user_id, *chunk])
+            for row in rows:
+                notes[row['match_id']] = dict(row)
+    return notes
+
+def save_match_note(match_id, user_id, note_text):
+    """Save or update note for a match"""
+    now = datetime.utcnow().isoformat()
+    with transaction() as conn:
+        conn.execute(
+            'INSERT INTO notes (match_id, user_id, note_text, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (match_id, user_id) DO UPDATE SET '
+            'note_text = excluded.note_text, updated_at = excluded.updated_at',
+            (match_id, user_id, note_text, now, now)
+        )
+        return get_match_note(match_id, user_id)
+
+def delete_match_note(match_id, user_id):
+    """Delete note for a match"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM notes WHERE match_id = ? AND user_id = ?', (match_id, user_id))
@@ -23,13 +23,12 @@ export default function Dashboard() {
     loadMatches();
   }, []);
 
-  // Load current and past matches from backend
+  // Load current and past matches (with note previews) from backend in one request
   const loadMatches = async () => {
     try {
-      const current = await apiGet('/matches/current');
-      const past = await apiGet('/matches/past');
-      setCurrentMatches(current || []);
-      setPastMatches(past || []);
+      const dashboard = await apiGet('/matches/dashboard');
+      setCurrentMatches(dashboard.current || []);
+      setPastMatches(dashboard.past || []);
     } catch (error) {
       console.error('Error loading matches:', error);
       setCurrentMatches([]);
@@ -73,7 +72,7 @@ export default function Dashboard() {
   // Handle opening notes editor for a match
   const handleEditNotes = async (matchId, currentNotes) => {
     setEditingNotes(matchId);
-    // Load notes from backend
+    // The dashboard only has a preview - load the whole note from backend
     const notesData = await apiGet(`/notes/match/${matchId}`);
     setNotesText(notesData.note || "");
   };
@@ -211,7 +210,8 @@ export default function Dashboard() {
                       </div>
                     ) : (
                       <p className="notes-display">
-                        {match.notes || "No notes yet."}
+                        {/* The dashboard gets the start of long notes - show that there's more */}
+                        {match.notes ? match.notes + (match.notes_truncated ? "…" : "") : "No notes yet."}
                       </p>
                     )}
                   </div>
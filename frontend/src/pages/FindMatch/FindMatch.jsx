@@ -1,7 +1,7 @@
 import React, { useState } from "react";
 import "./FindMatch.css";
 import { useNavigate } from "react-router-dom";
-import { apiPost } from "../../utils/api";
+import { apiGet } from "../../utils/api";
 
 export default function FindMatch() {
   const navigate = useNavigate();
@@ -10,13 +10,22 @@ export default function FindMatch() {
   const handleFindMatch = async () => {
     setIsLoading(true);
     try {
-      // Call backend to find a match
-      const matchData = await apiPost('/matches/find', {});
-      // Store match data in sessionStorage to pass to MatchResult page
+      // Start from the first page of the feed every time, so new people
+      // and changed interests show up. One page covers a whole run of
+      // swipes on the MatchResult page
+      const feed = await apiGet('/matches/feed?limit=20');
+      if (!feed.users.length) {
+        throw new Error('No available users to match with');
+      }
+      // Store the first person and the rest of the feed in sessionStorage
+      // to pass to MatchResult page
+      const matchData = feed.users.shift();
+      sessionStorage.setItem('matchFeed', JSON.stringify(feed));
       sessionStorage.setItem('currentMatch', JSON.stringify(matchData));
       setIsLoading(false);
       navigate("/match-result");
     } catch (error) {
+      sessionStorage.removeItem('matchFeed');
       setIsLoading(false);
       console.error('Error finding match:', error);
     }
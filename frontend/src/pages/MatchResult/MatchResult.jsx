@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from "react";
 import "./MatchResult.css";
 import { useNavigate } from "react-router-dom";
-import { apiPost } from "../../utils/api";
+import { apiGet, apiPost } from "../../utils/api";
 
 export default function MatchResult() {
   const navigate = useNavigate();
@@ -27,19 +27,40 @@ export default function MatchResult() {
       });
       // Clear sessionStorage
       sessionStorage.removeItem('currentMatch');
+      sessionStorage.removeItem('matchFeed');
       navigate("/matches");
     }
   };
 
+  // Show the next person from the feed (loaded by FindMatch), fetching
+  // the next page when this one runs out
+  const showNextMatch = async () => {
+    const feed = JSON.parse(sessionStorage.getItem('matchFeed') || '{"users": [], "next_cursor": null}');
+    if (!feed.users.length && feed.next_cursor) {
+      const page = await apiGet(`/matches/feed?limit=20&cursor=${encodeURIComponent(feed.next_cursor)}`);
+      feed.users = page.users;
+      feed.next_cursor = page.next_cursor;
+    }
+    if (feed.users.length) {
+      const nextMatch = feed.users.shift();
+      sessionStorage.setItem('matchFeed', JSON.stringify(feed));
+      sessionStorage.setItem('currentMatch', JSON.stringify(nextMatch));
+      setMatchedPerson(nextMatch);
+    } else {
+      // Nobody left - clear sessionStorage
+      sessionStorage.removeItem('matchFeed');
+      sessionStorage.removeItem('currentMatch');
+      navigate("/find-match");
+    }
+  };
+
   const handleDecline = async () => {
     if (matchedPerson) {
       // Call backend to decline match
       await apiPost('/matches/decline', {
         user_id: matchedPerson.id
       });
-      // Clear sessionStorage
-      sessionStorage.removeItem('currentMatch');
-      navigate("/find-match");
+      await showNextMatch();
     }
   };
 
@@ -11,15 +11,26 @@ export default function Search() {
   const navigate = useNavigate();
   const [searchQuery, setSearchQuery] = useState("");
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
 
-  // Load users from backend
+  // Load the first page of users from backend
   useEffect(() => {
     loadUsers();
   }, [searchQuery]);
 
   const loadUsers = async () => {
-    const usersData = await apiGet(`/search/users?q=${encodeURIComponent(searchQuery)}`);
-    setUsers(usersData);
+    const page = await apiGet(`/search/users?q=${encodeURIComponent(searchQuery)}&limit=20`);
+    setUsers(page.users);
+    setNextCursor(page.next_cursor);
+  };
+
+  // Add the next page of users after the ones already shown
+  const loadMoreUsers = async () => {
+    const page = await apiGet(
+      `/search/users?q=${encodeURIComponent(searchQuery)}&limit=20&cursor=${encodeURIComponent(nextCursor)}`
+    );
+    setUsers([...users, ...page.users]);
+    setNextCursor(page.next_cursor);
   };
 
   // Handle follow/unfollow action
@@ -29,8 +40,11 @@ export default function Search() {
     } else {
       await apiPost('/search/follow', { user_id: userId });
     }
-    // Reload users to update follow status
-    loadUsers();
+    // Update follow status in place, so the pages already loaded stay
+    setUsers(users.map((u) => u.id === userId
+      ? { ...u, is_following: !isFollowing, followers: (u.followers || 0) + (isFollowing ? -1 : 1) }
+      : u
+    ));
   };
 
   const handleGoToDashboard = () => {
@@ -157,6 +171,14 @@ export default function Search() {
               </div>
             )}
           </div>
+
+          {nextCursor && (
+            <div className="load-more">
+              <button className="btn-load-more" onClick={loadMoreUsers}>
+                Load more
+              </button>
+            </div>
+          )}
         </div>
       </main>
     </div>